@@ -0,0 +1,84 @@
+import json
+import numpy as np
+
+# infer_output.npz holds the same results as infer_output.json in columns:
+#   labels        label table, stored once
+#   label_ids     (paragraphs x K) indices into labels, best label first
+#   scores        (paragraphs x K) scores matching label_ids (NaN with -l)
+#   text_bytes    UTF-8 paragraph texts, concatenated
+#   text_offsets  start of every text in text_bytes, plus the end of the last
+#   top_label     True when written with -l (only the top label is kept)
+
+
+class CompactWriter:
+    def __init__(self, labels, dtype='float16'):
+        self.labels = list(labels)
+        self.label_index = {label: index for index, label in enumerate(self.labels)}
+        self.dtype = dtype
+        self.label_ids = []
+        self.scores = []
+        self.texts = []
+        self.top_label = False
+
+    def add(self, result):
+        # Add one infer_output.json entry
+        if 'label' in result:
+            self.top_label = True
+            entries = [(result['label'], float('nan'))]
+        else:
+            entries = [(item['label'], item['score']) for item in result['results']]
+        ids = []
+        for label, _ in entries:
+            if label not in self.label_index:
+                self.label_index[label] = len(self.labels)
+                self.labels.append(label)
+            ids.append(self.label_index[label])
+        self.label_ids.append(ids)
+        self.scores.append([score for _, score in entries])
+        self.texts.append(result['text'].encode('utf-8'))
+
+    def save(self, path):
+        width = max((len(ids) for ids in self.label_ids), default=0)
+        if any(len(ids) != width for ids in self.label_ids):
+            raise ValueError("Every result must keep the same number of labels")
+        offsets = np.zeros(len(self.texts) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in self.texts], out=offsets[1:])
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                labels=np.array(self.labels, dtype=str),
+                label_ids=np.array(self.label_ids, dtype=np.int32).reshape(len(self.texts), width),
+                scores=np.array(self.scores, dtype=self.dtype).reshape(len(self.texts), width),
+                text_bytes=np.frombuffer(b''.join(self.texts), dtype=np.uint8),
+                text_offsets=offsets,
+                top_label=np.array(self.top_label)
+            )
+        return len(self.texts)
+
+
+def stream_to_compact(stream_path, compact_path, labels, dtype='float16'):
+    # Convert the JSONL stream of distilbert_infer.py --stream
+    writer = CompactWriter(labels, dtype)
+    with open(stream_path, 'r') as stream:
+        for line in stream:
+            writer.add(json.loads(line))
+    return writer.save(compact_path)
+
+
+def read_compact(path):
+    # Return (labels, label_ids, scores, texts, top_label) from infer_output.npz
+    with np.load(path) as data:
+        labels = data['labels'].tolist()
+        text_bytes = data['text_bytes'].tobytes()
+        offsets = data['text_offsets'].tolist()
+        texts = [text_bytes[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+        return labels, data['label_ids'], data['scores'], texts, bool(data['top_label'])
+
+
+def load_results(path):
+    # Rebuild infer_output.json style entries from infer_output.npz
+    labels, label_ids, scores, texts, top_label = read_compact(path)
+    if top_label:
+        return [{'text': text, 'label': labels[ids[0]]} for text, ids in zip(texts, label_ids.tolist())]
+    return [{'text': text, 'results': [{'label': labels[index], 'score': score} for index, score in zip(ids, row)]}
+            for text, ids, row in zip(texts, label_ids.tolist(), scores.astype(np.float64).tolist())]
@@ -0,0 +1,103 @@
+# Client side of distilbert_daemon.py. It only uses the standard library, so
+# gui.py can talk to the daemon without loading torch or transformers.
+
+import json
+import os
+import secrets
+import socket
+
+DEFAULT_PORT = 8765
+
+
+class DaemonUnavailable(Exception):
+    # The daemon is not running, serves another folder or uses other model settings
+    pass
+
+
+def token_path(port=DEFAULT_PORT):
+    # Written by the daemon in the folder it serves, readable only by its owner
+    return f".daemon_token_{port}"
+
+
+def write_token(port=DEFAULT_PORT):
+    # A new random token for every daemon start; requests without it are refused
+    token = secrets.token_hex(32)
+    path = token_path(port)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    os.replace(temporary_path, path)
+    return token
+
+
+def read_token(port=DEFAULT_PORT):
+    try:
+        with open(token_path(port), 'r') as f:
+            return f.read().strip()
+    except OSError:
+        raise DaemonUnavailable(f"No daemon token for port {port} in this folder")
+
+
+def send_request(message, port=DEFAULT_PORT, timeout=None):
+    # Send one JSON request and yield the JSON events the daemon streams back
+    token = read_token(port)
+    try:
+        connection = socket.create_connection(('127.0.0.1', port), timeout=1.0)
+    except OSError:
+        raise DaemonUnavailable(f"No daemon listening on port {port}")
+    connection.settimeout(timeout)
+    with connection, connection.makefile('rw', encoding='utf-8') as channel:
+        channel.write(json.dumps({'cwd': os.path.realpath(os.getcwd()), 'token': token, **message}) + '\n')
+        channel.flush()
+        for line in channel:
+            event = json.loads(line)
+            if event['event'] == 'error':
+                raise DaemonUnavailable(event['message'])
+            yield event
+            if event['event'] == 'done':
+                return
+    raise DaemonUnavailable("The daemon closed the connection")
+
+
+def status(port=DEFAULT_PORT):
+    # Return the daemon settings, or None when no daemon serves this folder
+    try:
+        for event in send_request({'type': 'status'}, port, timeout=5.0):
+            if event['event'] == 'done':
+                return event['status']
+    except DaemonUnavailable:
+        return None
+
+
+def matches(status, model_dir, backend='torch', window_overlap=64, window_combine='weighted'):
+    # Whether a daemon with this status classifies like distilbert_infer.py
+    # with these settings (the defaults are those of distilbert_infer.py)
+    return (status is not None
+            and os.path.realpath(status['model_dir']) == os.path.realpath(model_dir)
+            and status['backend'] == backend
+            and status['window_overlap'] == window_overlap
+            and status['window_combine'] == window_combine)
+
+
+def shutdown(port=DEFAULT_PORT):
+    try:
+        for _ in send_request({'type': 'shutdown'}, port, timeout=5.0):
+            pass
+    except DaemonUnavailable:
+        pass
+
+
+def classify(texts, options, port=DEFAULT_PORT, on_progress=None):
+    # Classify paragraphs with the warm model. Returns one infer_output.json
+    # entry per text, or None for paragraphs skipped with skip_long. With the
+    # 'rows' option it returns {'labels': [...], 'rows': [...]} with the raw
+    # label probabilities of every text (None where skipped) instead.
+    # on_progress(done, total) is called while batches finish.
+    results = None
+    for event in send_request({'type': 'classify', 'texts': texts, 'options': options}, port):
+        if event['event'] == 'progress' and on_progress is not None:
+            on_progress(event['done'], event['total'])
+        elif event['event'] == 'results':
+            results = event['results']
+    return results
@@ -0,0 +1,187 @@
+# this script will estimate the accuracy of distilbert_train.py on unseen paragraphs with stratified k-fold cross-validation
+# train_input.json is split into k folds with the same label mix; every fold is classified by a model trained on the other folds
+# the folds are trained in parallel worker processes that share the CPU threads and one tokenized dataset
+# the result is a report with the metrics of every fold, their mean and spread, and per-label scores over all held-out predictions
+# (also saved to cv_results.json); trained_model_1 is not touched
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import statistics
+import time
+from distilbert_sweep import BASE_MODEL, init_worker
+
+RUN_DIR = 'cv_runs'
+METRICS = ('accuracy', 'precision', 'recall', 'f1')
+
+
+def run_fold(task):
+    # Train on every fold but task['fold'] and predict the held-out fold
+    from datasets import Dataset
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification, DataCollatorWithPadding
+    from transformers import TrainingArguments, Trainer
+    from transformers.trainer_callback import PrinterCallback
+    from distilbert_train import compute_metrics
+
+    started = time.perf_counter()
+    dataset = Dataset.load_from_disk(task['dataset_path'])
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, clean_up_tokenization_spaces=True)
+    id2label = {int(k): v for k, v in task['id2label'].items()}
+    model = AutoModelForSequenceClassification.from_pretrained(
+        BASE_MODEL,
+        num_labels=len(id2label),
+        id2label=id2label,
+        label2id={v: k for k, v in id2label.items()},
+        problem_type="single_label_classification"
+    )
+    # The default settings of distilbert_train.py: batches of 8 paragraphs of
+    # similar length, without --max-tokens, --profile fast-cpu or early stopping
+    training_args = TrainingArguments(
+        output_dir=task['output_dir'],
+        save_strategy="no",
+        learning_rate=2e-5,
+        per_device_train_batch_size=8,
+        num_train_epochs=task['epochs'],
+        weight_decay=0.01,
+        group_by_length=True,
+        length_column_name='length',
+        disable_tqdm=True,
+        report_to=[]
+    )
+    trainer = Trainer(
+        model=model,
+        args=training_args,
+        train_dataset=dataset.select(task['train_indices']),
+        data_collator=DataCollatorWithPadding(tokenizer=tokenizer),
+        tokenizer=tokenizer,
+        compute_metrics=compute_metrics
+    )
+    trainer.remove_callback(PrinterCallback)  # Only the summary line of every fold is printed
+    trainer.train()
+    prediction = trainer.predict(dataset.select(task['test_indices']))
+    shutil.rmtree(task['output_dir'], ignore_errors=True)
+    return {
+        'fold': task['fold'],
+        'train_size': len(task['train_indices']),
+        'test_size': len(task['test_indices']),
+        **{metric: prediction.metrics[f'test_{metric}'] for metric in METRICS},
+        'seconds': time.perf_counter() - started,
+        'test_indices': task['test_indices'],
+        'predicted': prediction.predictions.argmax(-1).tolist()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DistilBERT Cross-Validation Script")
+    parser.add_argument('-k', '--folds', type=int, default=5, help="Number of folds (default: 5)")
+    parser.add_argument('-w', '--workers', type=int, help="Folds trained at the same time (default: the number of folds, at most the CPU cores)")
+    parser.add_argument('--threads-per-fold', type=int, help="Intra-op threads of every fold (default: CPU cores divided by --workers)")
+    parser.add_argument('--epochs', type=int, default=16, help="Training epochs of every fold (default: 16, as distilbert_train.py)")
+    args = parser.parse_args()
+
+    if args.folds < 2:
+        parser.error("--folds must be at least 2")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.threads_per_fold is not None and args.threads_per_fold < 1:
+        parser.error("--threads-per-fold must be at least 1")
+    if args.epochs < 1:
+        parser.error("--epochs must be at least 1")
+
+    with open('train_labels.json', 'r') as f:
+        id2label = {int(k): v['label'] for k, v in json.load(f).items()}
+    with open('train_input.json', 'r') as file:
+        train_dataset = json.load(file)
+    texts = [item['text'] for item in train_dataset]
+    labels = [item['label'] for item in train_dataset]
+    if args.folds > len(texts):
+        parser.error(f"--folds must be at most the number of examples ({len(texts)})")
+
+    # Split the cores between the folds that train at the same time
+    cores = os.cpu_count() or 1
+    workers = min(args.workers or min(args.folds, cores), args.folds)
+    threads = args.threads_per_fold or max(1, cores // workers)
+
+    from transformers import AutoTokenizer
+    from distilbert_train import stratified_folds, tokenize_training_set
+    from distilbert_validate import ConfusionMatrix
+
+    # Tokenize once; every worker memory-maps the same Arrow files
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, clean_up_tokenization_spaces=True)
+    tokenized_dataset, _ = tokenize_training_set(tokenizer, texts, labels, id2label)
+    dataset_path = os.path.dirname(tokenized_dataset.cache_files[0]['filename'])
+    folds = stratified_folds(labels, args.folds)
+
+    if os.path.exists(RUN_DIR):
+        shutil.rmtree(RUN_DIR)
+    tasks = [{
+        'fold': number,
+        'epochs': args.epochs,
+        'dataset_path': dataset_path,
+        'train_indices': sorted(index for other, indices in enumerate(folds, start=1) if other != number for index in indices),
+        'test_indices': test_indices,
+        'id2label': id2label,
+        'output_dir': os.path.join(RUN_DIR, f"fold-{number}")
+    } for number, test_indices in enumerate(folds, start=1)]
+    print(f"{args.folds} folds of {len(texts)} examples, {workers} at a time with {threads} threads each")
+
+    results = []
+    matrix = ConfusionMatrix()
+    started = time.perf_counter()
+    pool = multiprocessing.get_context('spawn').Pool(workers, initializer=init_worker, initargs=(threads,), maxtasksperchild=1)
+    try:
+        for result in pool.imap_unordered(run_fold, tasks):
+            print(f"Fold {result['fold']}: F1 {result['f1']:.4f}, accuracy {result['accuracy']:.4f} ({result['seconds']:.1f}s)", flush=True)
+            for index, predicted in zip(result.pop('test_indices'), result.pop('predicted')):
+                matrix.add(id2label[labels[index]], id2label[predicted])
+            results.append(result)
+    except BaseException:
+        # Stop the running workers now instead of waiting for their training to finish
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+        shutil.rmtree(RUN_DIR, ignore_errors=True)
+    results.sort(key=lambda result: result['fold'])
+
+    print(f"\nCross-validation finished in {time.perf_counter() - started:.1f}s\n")
+    print(f"{'Fold':>4}  {'Train':>5}  {'Test':>5}  {'Accuracy':>8}  {'Precision':>9}  {'Recall':>6}  {'F1':>6}  {'Time':>8}")
+    for result in results:
+        print(f"{result['fold']:>4}  {result['train_size']:>5}  {result['test_size']:>5}  {result['accuracy']:>8.4f}  "
+              f"{result['precision']:>9.4f}  {result['recall']:>6.4f}  {result['f1']:>6.4f}  {result['seconds']:>7.1f}s")
+    summary = {metric: (statistics.mean(result[metric] for result in results), statistics.stdev(result[metric] for result in results))
+               for metric in METRICS}
+    print(f"{'Mean':>4}  {'':>5}  {'':>5}  " + "  ".join(f"{summary[metric][0]:>{width}.4f}" for metric, width in zip(METRICS, (8, 9, 6, 6))))
+    print(f"{'Std':>4}  {'':>5}  {'':>5}  " + "  ".join(f"{summary[metric][1]:>{width}.4f}" for metric, width in zip(METRICS, (8, 9, 6, 6))))
+
+    # Every example was held out exactly once, so its prediction is an honest one
+    correct = sum(count for (true_label, predicted_label), count in matrix.counts.items() if true_label == predicted_label)
+    precision, recall, f1 = matrix.weighted()
+    print(f"\nAll held-out predictions ({len(texts)} examples):")
+    print(f"Accuracy: {correct / len(texts):.4f}")
+    print(f"Precision: {precision:.4f}")
+    print(f"Recall: {recall:.4f}")
+    print(f"F1 Score: {f1:.4f}")
+    per_label = matrix.per_label()
+    print(f"\n{'Label':<20}  {'Precision':>9}  {'Recall':>6}  {'F1':>6}  {'Support':>7}")
+    for label in sorted(per_label, key=lambda label: -per_label[label][3]):
+        label_precision, label_recall, label_f1, support = per_label[label]
+        print(f"{label:<20}  {label_precision:>9.4f}  {label_recall:>6.4f}  {label_f1:>6.4f}  {support:>7}")
+
+    with open('cv_results.json', 'w') as f:
+        json.dump({
+            'folds': results,
+            'mean': {metric: summary[metric][0] for metric in METRICS},
+            'std': {metric: summary[metric][1] for metric in METRICS},
+            'overall': {'accuracy': correct / len(texts), 'precision': precision, 'recall': recall, 'f1': f1},
+            'labels': {label: dict(zip(('precision', 'recall', 'f1', 'support'), scores)) for label, scores in per_label.items()}
+        }, f, indent=2)
+    print("\nResults written to cv_results.json")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+# this script will keep trained_model_1 and the rules from train_labels.json loaded in a background process
+# distilbert_infer.py and gui.py send paragraphs to it over a localhost socket instead of loading the model themselves
+# the model and labels are reloaded when their files change on disk
+# requests must carry the token the daemon writes to .daemon_token_<port> (readable only by its owner)
+
+import argparse
+import hmac
+import json
+import os
+import socketserver
+import threading
+import time
+import torch
+from daemon_client import DEFAULT_PORT, token_path, write_token
+from distilbert_infer import WindowClassifier, LabelRules, classify_texts, build_results
+from prediction_cache import PredictionCache
+
+
+class EventProgress:
+    # Stands in for tqdm and reports finished paragraphs to the client
+    def __init__(self, send, total):
+        self.send = send
+        self.total = total
+        self.done = 0
+
+    def update(self, count):
+        if count:
+            self.done += count
+            self.send({'event': 'progress', 'done': self.done, 'total': self.total})
+
+
+class InferenceService:
+    def __init__(self, args):
+        self.args = args
+        self.cwd = os.path.realpath(os.getcwd())
+        self.lock = threading.Lock()
+        self.signature = None
+        self.load()
+
+    def files_signature(self):
+        # Size and modification time of the model files and the labels file;
+        # the onnx backends load their graph from the onnx folder instead
+        folders = [self.args.model_dir]
+        if self.args.backend in ('onnx', 'onnx-int8'):
+            folders.append(os.path.join(self.args.model_dir, 'onnx'))
+        paths = [os.path.join(folder, name) for folder in folders if os.path.isdir(folder) for name in sorted(os.listdir(folder))]
+        paths = [path for path in paths if os.path.isfile(path)] + ['train_labels.json']
+        return tuple((path, os.path.getsize(path), os.path.getmtime(path)) for path in paths if os.path.exists(path))
+
+    def load(self):
+        signature = self.files_signature()
+        classifier = WindowClassifier(self.args.model_dir, self.args.window_overlap, self.args.window_combine, self.args.backend)
+        classifier.load()
+        with open('train_labels.json', 'r') as f:
+            labels_data = json.load(f)
+        self.classifier = classifier
+        self.labels_data = labels_data
+        self.label_rules = LabelRules(labels_data)
+        self.signature = signature
+        self.loaded_at = time.time()
+
+    def watch(self):
+        # Reload once the files have stopped changing, so a model that is still
+        # being written by distilbert_train.py is never picked up half-way
+        last_seen = self.signature
+        while True:
+            time.sleep(self.args.poll_interval)
+            try:
+                signature = self.files_signature()
+            except OSError:
+                continue  # trained_model_1 is being replaced
+            if signature != self.signature and signature == last_seen:
+                try:
+                    with self.lock:
+                        self.load()
+                    print("Reloaded trained_model_1 and train_labels.json", flush=True)
+                except Exception as e:
+                    print(f"Reload failed, keeping the previous model: {e}", flush=True)
+            last_seen = signature
+
+    def status(self):
+        return {
+            'model_dir': self.args.model_dir,
+            'backend': self.args.backend,
+            'window_overlap': self.args.window_overlap,
+            'window_combine': self.args.window_combine,
+            'loaded_at': self.loaded_at
+        }
+
+    def classify(self, texts, options, send):
+        # Settings that change the model scores must match those of the client
+        for name in ('backend', 'window_overlap', 'window_combine'):
+            if name in options and options[name] != getattr(self.args, name):
+                raise ValueError(f"The daemon runs with {name}={getattr(self.args, name)}, the client asked for {options[name]}")
+
+        with self.lock:
+            classifier = self.classifier
+            cache = None
+            if self.args.cache:
+                # SQLite connections stay in the thread that opened them
+                cache = PredictionCache('infer_cache.sqlite', self.args.model_dir, self.labels_data, self.args.cache_size << 20, classifier.cache_variant())
+            try:
+                progress = EventProgress(send, len(texts))
+                rows = classify_texts(classifier, texts, options.get('batch_size', self.args.batch_size),
+                                      progress, cache, options.get('skip_long', False))
+            finally:
+                if cache is not None:
+                    cache.close()
+            if options.get('rows'):
+                # Raw label probabilities; the client applies the keyword rules itself
+                return {'labels': classifier.labels, 'rows': [None if row is None else row.tolist() for row in rows]}
+            return build_results(self.label_rules, classifier.labels, texts, rows,
+                                 options.get('no_normalize', False), options.get('top_label', False),
+                                 options.get('top_k'))
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        def send(event):
+            self.wfile.write((json.dumps(event) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+        service = self.server.service
+        try:
+            request = json.loads(self.rfile.readline())
+            # Only users who can read the token file of this folder may send requests
+            if not hmac.compare_digest(str(request.get('token', '')), self.server.token):
+                raise ValueError("Invalid daemon token")
+            if request.get('cwd') != service.cwd:
+                raise ValueError(f"The daemon serves {service.cwd}")
+            if request['type'] == 'status':
+                send({'event': 'done', 'status': service.status()})
+            elif request['type'] == 'shutdown':
+                send({'event': 'done'})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            elif request['type'] == 'classify':
+                started = time.perf_counter()
+                results = service.classify(request['texts'], request.get('options', {}), send)
+                send({'event': 'results', 'results': results})
+                send({'event': 'done', 'seconds': time.perf_counter() - started})
+            else:
+                raise ValueError(f"Unknown request type {request['type']}")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            try:
+                send({'event': 'error', 'message': str(e)})
+            except OSError:
+                pass
+
+
+class DaemonServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DistilBERT Inference Daemon")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"Localhost port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('--model-dir', default="trained_model_1", help="Model folder to serve (default: trained_model_1)")
+    parser.add_argument('-b', '--batch-size', type=int, default=32, help="Default number of paragraphs per forward pass (default: 32)")
+    parser.add_argument('--window-overlap', type=int, default=64, help="Tokens shared by consecutive windows of a long paragraph (default: 64)")
+    parser.add_argument('--window-combine', choices=WindowClassifier.COMBINE_METHODS, default='weighted', help="How window scores are combined (default: weighted)")
+    parser.add_argument('--backend', choices=WindowClassifier.BACKENDS, default='torch', help="Model runtime (default: torch)")
+    parser.add_argument('--threads', type=int, help="Intra-op threads used by the model (default: torch default)")
+    parser.add_argument('--cache', action='store_true', help="Reuse model predictions from infer_cache.sqlite")
+    parser.add_argument('--cache-size', type=int, default=256, help="Maximum size of the prediction cache in MB (default: 256)")
+    parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds between checks for changed model or label files (default: 2)")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    service = InferenceService(args)
+    server = DaemonServer(('127.0.0.1', args.port), RequestHandler)
+    server.service = service
+    server.token = write_token(args.port)
+    threading.Thread(target=service.watch, daemon=True).start()
+    print(f"Serving {args.model_dir} on 127.0.0.1:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.remove(token_path(args.port))
+        except OSError:
+            pass
+    print("Daemon stopped", flush=True)
+
+
+if __name__ == '__main__':
+    main()
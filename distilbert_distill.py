@@ -0,0 +1,196 @@
+# this script will distill trained_model_1 (the teacher) into a smaller student model for faster inference
+# the student learns the teacher's label probabilities on train_input.json and on the unlabeled paragraphs of infer_input.md
+# it is saved like trained_model_1, so distilbert_infer.py --model-dir student_model uses it unchanged
+# at the end the agreement of the student with the teacher and its speedup are reported on held-out paragraphs
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import time
+import torch
+import torch.nn.functional as F
+from transformers import AutoConfig, AutoTokenizer, AutoModelForSequenceClassification
+from transformers import DataCollatorWithPadding, TrainingArguments, Trainer
+from distilbert_infer import WindowClassifier, classify_in_batches
+from tokenization_cache import load_tokenized_dataset
+
+
+class DistillationTrainer(Trainer):
+    # Loss: KL divergence to the softened teacher probabilities, mixed with
+    # cross entropy on the labels of train_input.json (-100 for unlabeled paragraphs)
+    def __init__(self, *args, temperature, alpha, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def compute_loss(self, model, inputs, return_outputs=False):
+        labels = inputs.pop('labels')
+        teacher_logits = inputs.pop('teacher_logits')
+        inputs.pop('length', None)  # Only used to group batches by length
+        outputs = model(**inputs)
+        logits = outputs.logits
+        soft_loss = F.kl_div(F.log_softmax(logits / self.temperature, dim=-1),
+                             F.softmax(teacher_logits / self.temperature, dim=-1),
+                             reduction='batchmean') * self.temperature ** 2
+        loss = self.alpha * soft_loss
+        if (labels != -100).any():
+            loss = loss + (1 - self.alpha) * F.cross_entropy(logits, labels, ignore_index=-100)
+        return (loss, outputs) if return_outputs else loss
+
+
+def teacher_logits(model, tokenized_dataset, tokenizer, batch_size=32):
+    # Teacher outputs for every paragraph, computed once before training
+    lengths = tokenized_dataset['length']
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    logits = [None] * len(order)
+    model.eval()
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            inputs = tokenizer.pad({'input_ids': [tokenized_dataset[index]['input_ids'] for index in batch]}, return_tensors='pt')
+            for index, row in zip(batch, model(**inputs).logits.tolist()):
+                logits[index] = row
+    return logits
+
+
+def build_student(teacher, teacher_dir, layers, hidden_size):
+    # Same architecture with fewer layers and/or a smaller hidden size. With the
+    # teacher's hidden size, the student starts from the teacher's embeddings,
+    # classifier and evenly spaced transformer layers.
+    config = AutoConfig.from_pretrained(teacher_dir)
+    teacher_layers = config.n_layers
+    config.n_layers = layers
+    if hidden_size is not None and hidden_size != config.dim:
+        config.hidden_dim = config.hidden_dim * hidden_size // config.dim
+        config.dim = hidden_size
+        config.n_heads = hidden_size // 64
+        print(f"Hidden size {hidden_size} differs from the teacher, so the student starts from random weights")
+        return AutoModelForSequenceClassification.from_config(config)
+
+    student = AutoModelForSequenceClassification.from_config(config)
+    kept = [round(i * (teacher_layers - 1) / max(layers - 1, 1)) for i in range(layers)]
+    teacher_state = teacher.state_dict()
+    student_state = {}
+    for name in student.state_dict():
+        match = re.search(r'\.layer\.(\d+)\.', name)
+        source = name if match is None else name.replace(match.group(0), f".layer.{kept[int(match.group(1))]}.", 1)
+        student_state[name] = teacher_state[source]
+    student.load_state_dict(student_state)
+    print(f"Student starts from teacher layers {kept}")
+    return student
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DistilBERT Distillation Script")
+    parser.add_argument('--teacher-dir', default="trained_model_1", help="Model to distill (default: trained_model_1)")
+    parser.add_argument('--output-dir', default="student_model", help="Folder the student is saved to (default: student_model)")
+    parser.add_argument('--layers', type=int, default=3, help="Transformer layers of the student (default: 3)")
+    parser.add_argument('--hidden-size', type=int, help="Hidden size of the student, a multiple of 64 (default: that of the teacher)")
+    parser.add_argument('--epochs', type=int, default=6, help="Training epochs (default: 6)")
+    parser.add_argument('--temperature', type=float, default=2.0, help="Softmax temperature of the teacher and student outputs (default: 2.0)")
+    parser.add_argument('--alpha', type=float, default=0.5, help="Weight of the teacher loss against the label loss (default: 0.5)")
+    parser.add_argument('--holdout', type=float, default=0.1, help="Fraction of paragraphs kept out of training to measure agreement and speed (default: 0.1)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.teacher_dir):
+        parser.error(f"{args.teacher_dir} not found. Run distilbert_train.py first.")
+    if args.layers < 1:
+        parser.error("--layers must be at least 1")
+    if args.hidden_size is not None and (args.hidden_size < 64 or args.hidden_size % 64):
+        parser.error("--hidden-size must be a multiple of 64 (one attention head per 64 dimensions)")
+    if not 0 <= args.alpha <= 1:
+        parser.error("--alpha must be between 0 and 1")
+    if not 0 < args.holdout < 1:
+        parser.error("--holdout must be between 0 and 1")
+
+    with open('train_labels.json', 'r') as f:
+        id2label = {int(k): v['label'] for k, v in json.load(f).items()}
+
+    # Labeled paragraphs from train_input.json and unlabeled ones from infer_input.md
+    with open('train_input.json', 'r') as file:
+        train_dataset = json.load(file)
+    examples = {item['text']: item['label'] for item in train_dataset}
+    if os.path.exists('infer_input.md'):
+        with open('infer_input.md', 'r') as file:
+            for paragraph in file.read().split('\n\n'):
+                if paragraph.strip():
+                    examples.setdefault(paragraph, -100)
+    texts = list(examples)
+    labels = list(examples.values())
+    print(f"Distilling on {sum(label != -100 for label in labels)} labeled and {sum(label == -100 for label in labels)} unlabeled paragraphs")
+
+    tokenizer = AutoTokenizer.from_pretrained(args.teacher_dir, clean_up_tokenization_spaces=True)
+
+    def preprocess_function(examples):
+        tokens = tokenizer(examples["text"], truncation=True)
+        tokens['length'] = [len(ids) for ids in tokens['input_ids']]
+        return tokens
+
+    tokenized_dataset, _ = load_tokenized_dataset(texts, labels, id2label, tokenizer, preprocess_function,
+                                                  {'truncation': True, 'padding': False, 'length': True, 'map_batch_size': 1000})
+
+    teacher = AutoModelForSequenceClassification.from_pretrained(args.teacher_dir)
+    if args.layers > teacher.config.n_layers or (args.layers == teacher.config.n_layers and args.hidden_size in (None, teacher.config.dim)):
+        parser.error(f"The student must be smaller than the teacher ({teacher.config.n_layers} layers, hidden size {teacher.config.dim})")
+    tokenized_dataset = tokenized_dataset.add_column('teacher_logits', teacher_logits(teacher, tokenized_dataset, tokenizer))
+
+    indices = list(range(len(texts)))
+    random.Random(42).shuffle(indices)
+    holdout_count = max(1, round(len(indices) * args.holdout))
+    holdout_indices = sorted(indices[:holdout_count])
+    train_dataset = tokenized_dataset.select(sorted(indices[holdout_count:])).remove_columns(['text'])
+
+    student = build_student(teacher, args.teacher_dir, args.layers, args.hidden_size)
+    del teacher
+
+    training_args = TrainingArguments(
+        output_dir=args.output_dir + "_run",
+        save_strategy="no",
+        learning_rate=5e-5,
+        per_device_train_batch_size=8,
+        num_train_epochs=args.epochs,
+        weight_decay=0.01,
+        group_by_length=True,
+        length_column_name='length',
+        remove_unused_columns=False  # teacher_logits is used by the loss
+    )
+    trainer = DistillationTrainer(
+        model=student,
+        args=training_args,
+        train_dataset=train_dataset,
+        data_collator=DataCollatorWithPadding(tokenizer=tokenizer),
+        tokenizer=tokenizer,
+        temperature=args.temperature,
+        alpha=args.alpha
+    )
+    trainer.train()
+
+    if os.path.exists(args.output_dir):
+        shutil.rmtree(args.output_dir)
+    trainer.save_model(args.output_dir)
+    shutil.rmtree(args.output_dir + "_run", ignore_errors=True)
+    print(f"Saved the student to {args.output_dir}")
+
+    # Compare both models on the held-out paragraphs through the inference pipeline
+    holdout_texts = [texts[index] for index in holdout_indices]
+
+    def run(model_dir):
+        classifier = WindowClassifier(model_dir, 64, 'weighted')
+        classifier.load()
+        started = time.perf_counter()
+        outputs, _ = classify_in_batches(classifier, holdout_texts, 32)
+        return outputs, time.perf_counter() - started
+
+    teacher_outputs, teacher_time = run(args.teacher_dir)
+    student_outputs, student_time = run(args.output_dir)
+    agree = sum(1 for expected, actual in zip(teacher_outputs, student_outputs) if expected.argmax() == actual.argmax())
+    print(f"\nStudent ({student.config.n_layers} layers, hidden size {student.config.dim}): top label agreement with the teacher {agree / len(holdout_texts) * 100:.2f}% "
+          f"on {len(holdout_texts)} held-out paragraphs")
+    print(f"Teacher {teacher_time:.2f}s, student {student_time:.2f}s ({teacher_time / max(student_time, 1e-9):.2f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
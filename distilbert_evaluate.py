@@ -0,0 +1,66 @@
+# this script will evaluate a trained model on train_input.json in one step, without the Markdown round trip
+# (trainjson_to_infermd.py, distilbert_infer.py and distilbert_validate.py)
+# the training texts are classified in memory in batches, with the keyword rules and normalization of distilbert_infer.py,
+# and the report of distilbert_validate.py is computed directly from the results; no files are written
+# every training paragraph is evaluated as a whole, including paragraphs that contain blank lines
+
+import argparse
+import json
+import os
+import time
+from tqdm import tqdm
+from distilbert_infer import LabelRules, WindowClassifier, build_results, classify_in_batches
+from distilbert_validate import build_train_index, validate, print_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DistilBERT Training Set Evaluation Script")
+    parser.add_argument('--model-dir', default="trained_model_1", help="Model folder to evaluate (default: trained_model_1)")
+    parser.add_argument('-c', '--no-normalize', action='store_true', help="Do not normalize scores")
+    parser.add_argument('-l', '--top-label', action='store_true', help="Only score the top label, as distilbert_infer.py -l")
+    parser.add_argument('--top-k', type=int, metavar='K', help="Only keep the K best labels of every paragraph for the overall metrics (default: all labels)")
+    parser.add_argument('-b', '--batch-size', type=int, default=32, help="Number of paragraphs classified per forward pass (default: 32)")
+    parser.add_argument('--window-overlap', type=int, default=64, help="Tokens shared by consecutive windows of a long paragraph (default: 64)")
+    parser.add_argument('--window-combine', choices=WindowClassifier.COMBINE_METHODS, default='weighted',
+                        help="How the window probabilities of a long paragraph are combined (default: weighted)")
+    parser.add_argument('--backend', choices=WindowClassifier.BACKENDS, default='torch', help="Inference backend (default: torch)")
+    args = parser.parse_args()
+
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.top_k is not None and args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+    if args.window_overlap < 0:
+        parser.error("--window-overlap must not be negative")
+    if not os.path.isdir(args.model_dir):
+        parser.error(f"{args.model_dir} not found. Run distilbert_train.py first.")
+
+    with open('train_input.json', 'r') as file:
+        train_dataset = json.load(file)
+    with open('train_labels.json', 'r') as f:
+        labels_data = json.load(f)
+    label_mapping = {str(k): v['label'] for k, v in labels_data.items()}
+    label_rules = LabelRules(labels_data)
+
+    classifier = WindowClassifier(args.model_dir, args.window_overlap, args.window_combine, args.backend)
+    if args.window_overlap > classifier.max_length // 2:
+        parser.error(f"--window-overlap must be at most {classifier.max_length // 2}")
+
+    # Empty paragraphs are never classified by distilbert_infer.py either
+    texts = [item['text'] for item in train_dataset if item['text'].strip()]
+    started = time.perf_counter()
+    with tqdm(total=len(texts), desc="Processing paragraphs") as progress:
+        rows, _ = classify_in_batches(classifier, texts, args.batch_size, progress=progress)
+    elapsed = time.perf_counter() - started
+    results = build_results(label_rules, classifier.labels, texts, rows, args.no_normalize, args.top_label, args.top_k)
+    print(f"Classified {len(texts)} paragraphs in {elapsed:.1f}s ({len(texts) / max(elapsed, 1e-9):.1f} paragraphs/s)")
+
+    # The same (text, labels best first) pairs distilbert_validate.py reads from infer_output.json
+    predictions = ((result['text'], [result['label']] if args.top_label else [entry['label'] for entry in result['results']])
+                   for result in results)
+    report = validate(build_train_index(train_dataset, label_mapping), predictions)
+    print_report(report, len(train_dataset))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# this script will export trained_model_1 to an ONNX graph for the onnx backends of distilbert_infer.py
+# with -q it will also write a dynamically int8-quantized copy of the graph
+# with -p it will compare the other backends against the torch backend on paragraphs from infer_input.md
+
+import argparse
+import inspect
+import os
+import time
+import torch
+from transformers import AutoModelForSequenceClassification
+from distilbert_infer import WindowClassifier, classify_in_batches
+
+parser = argparse.ArgumentParser(description="DistilBERT ONNX Export Script")
+parser.add_argument('-q', '--quantize', action='store_true', help="Also write a dynamically int8-quantized graph")
+parser.add_argument('-p', '--parity', action='store_true', help="Compare the exported backends against the torch backend")
+parser.add_argument('-n', '--parity-samples', type=int, default=200, help="Paragraphs from infer_input.md used by the parity check (default: 200)")
+args = parser.parse_args()
+
+try:
+    import onnxruntime
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+except ImportError:
+    raise SystemExit("Exporting needs onnx and onnxruntime: pip3 install onnx onnxruntime")
+
+model_dir = "trained_model_1"
+export_dir = os.path.join(model_dir, "onnx")
+onnx_path = os.path.join(export_dir, "model.onnx")
+int8_path = os.path.join(export_dir, "model.int8.onnx")
+os.makedirs(export_dir, exist_ok=True)
+
+model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+model.eval()
+model.config.return_dict = False
+
+# Batch size and sequence length stay dynamic so inference can pad per batch
+dummy = torch.ones((2, 16), dtype=torch.long)
+export_options = {}
+if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+    export_options['dynamo'] = False  # Newer torch releases default to the dynamo exporter
+torch.onnx.export(
+    model,
+    (dummy, dummy),
+    onnx_path,
+    input_names=['input_ids', 'attention_mask'],
+    output_names=['logits'],
+    dynamic_axes={
+        'input_ids': {0: 'batch', 1: 'sequence'},
+        'attention_mask': {0: 'batch', 1: 'sequence'},
+        'logits': {0: 'batch'}
+    },
+    opset_version=14,
+    **export_options
+)
+print(f"Exported {onnx_path}")
+
+if args.quantize:
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"Quantized {int8_path}")
+
+if args.parity:
+    with open('infer_input.md', 'r') as file:
+        texts = [paragraph for paragraph in file.read().split('\n\n') if paragraph.strip()][:args.parity_samples]
+    if not texts:
+        raise SystemExit("infer_input.md has no paragraphs for the parity check.")
+
+    def run(backend):
+        classifier = WindowClassifier(model_dir, 64, 'weighted', backend)
+        classifier.load()
+        started = time.perf_counter()
+        outputs, _ = classify_in_batches(classifier, texts, 32)
+        elapsed = time.perf_counter() - started
+        return outputs, elapsed
+
+    reference, reference_time = run('torch')
+    backends = ['torch-int8', 'onnx'] + (['onnx-int8'] if os.path.exists(int8_path) else [])
+    print(f"\nParity against torch on {len(texts)} paragraphs ({reference_time:.2f}s):")
+    for backend in backends:
+        scores, elapsed = run(backend)
+        agree = sum(1 for expected, actual in zip(reference, scores) if expected.argmax() == actual.argmax())
+        max_diff = max(float(abs(expected - actual).max()) for expected, actual in zip(reference, scores))
+        print(f"{backend}: top label agreement {agree / len(texts) * 100:.2f}%, "
+              f"largest score difference {max_diff:.6f}, {elapsed:.2f}s ({reference_time / elapsed:.2f}x)")
@@ -1,102 +1,701 @@
-from transformers import pipeline
+import numpy as np
 import json
+import multiprocessing
+import os
+import re
+import time
 import argparse
 from tqdm import tqdm
+from prediction_cache import PredictionCache
+from near_duplicates import group_duplicates
+from compact_output import CompactWriter, stream_to_compact
+from progress_events import ProgressEvents
+import daemon_client
 
-# Parse command-line arguments
-parser = argparse.ArgumentParser(description="DistilBERT Inference Script")
-parser.add_argument('-c', '--no-normalize', action='store_true', help="Do not normalize scores")
-parser.add_argument('-l', '--top-label', action='store_true', help="Only output the top label name")
-parser.add_argument('-s', '--skip-long', action='store_true', help="Automatically skip paragraphs exceeding maximum length")
-args = parser.parse_args()
-
-# Load the classifier with top_k=None to get all label probabilities
-classifier = pipeline("text-classification", model="trained_model_1", top_k=None)
-
-# Load the labels with explicit words
-with open('train_labels.json', 'r') as f:
-    labels_data = json.load(f)
-
-with open('infer_input.md', 'r') as file:
-    paragraphs = file.read().split('\n\n')
-
-results = []
-for i, paragraph in enumerate(tqdm(paragraphs, desc="Processing paragraphs"), start=1):
-    if paragraph.strip():
-        if len(paragraph) > 512:
-            if args.skip_long:
-                continue
-            else:
-                print(f"Paragraph {i} with {len(paragraph)} characters exceeds maximum length of 512.")
-                user_input = input("Enter 'c' to continue to the next paragraph, or 'q' to quit: ")
-                if user_input.lower() == 'q':
-                    print("Exiting program.")
-                    exit()
-                elif user_input.lower() == 'c':
+
+class LabelRules:
+    # increase_if / decrease_if / must_have rules from train_labels.json, compiled
+    # once into a label -> rule map and a single regex that finds every keyword
+    # in one pass over the lowercased paragraph
+    KINDS = ('must_have', 'increase_if', 'decrease_if')
+
+    def __init__(self, labels_data):
+        self.rules = {}
+        for data in labels_data.values():
+            # Keep the first entry for a label name, same as the old linear scan
+            if data['label'] not in self.rules:
+                self.rules[data['label']] = {kind: frozenset(word.lower() for word in data[kind]) for kind in self.KINDS}
+
+        keywords = set()
+        for rule in self.rules.values():
+            for kind in self.KINDS:
+                keywords.update(rule[kind])
+        # Column of every keyword in the (paragraphs x keywords) hit matrix
+        self.keyword_index = {word: column for column, word in enumerate(sorted(keywords))}
+        self.label_columns = {}
+
+        # An empty keyword is contained in every paragraph
+        self.always = frozenset(word for word in keywords if not word)
+        keywords = sorted(word for word in keywords if word)
+
+        # The regex reports the longest keyword starting at each position, so a
+        # hit also implies every keyword that is a substring of it
+        self.implied = {word: frozenset(other for other in keywords if other in word) for word in keywords}
+        self.pattern = re.compile('(?=(' + self._trie_pattern(keywords) + '))') if keywords else None
+
+    @staticmethod
+    def _trie_pattern(keywords):
+        # Factor common prefixes so the regex walks a trie instead of trying
+        # every alternative at every position
+        trie = {}
+        for word in keywords:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[''] = {}
+
+        def build(node):
+            is_end = '' in node
+            branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+            if not branches:
+                return ''
+            body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+            if is_end:
+                return '(?:' + body + ')?'
+            return body
+
+        return build(trie)
+
+    def matches(self, paragraph):
+        # Return the set of lowercased keywords contained in the paragraph
+        found = set(self.always)
+        if self.pattern is not None:
+            for match in self.pattern.finditer(paragraph.lower()):
+                found.update(self.implied[match.group(1)])
+        return found
+
+    def rule_matrices(self, labels):
+        # (keywords x labels) masks of which keyword belongs to which rule of
+        # which label, built once per label order
+        labels = tuple(labels)
+        if labels not in self.label_columns:
+            matrices = {kind: np.zeros((len(self.keyword_index), len(labels)), dtype=bool) for kind in self.KINDS}
+            for column, label in enumerate(labels):
+                rule = self.rules.get(label)
+                if rule is not None:
+                    for kind in self.KINDS:
+                        for word in rule[kind]:
+                            matrices[kind][self.keyword_index[word], column] = True
+            self.label_columns[labels] = matrices
+        return self.label_columns[labels]
+
+    def apply(self, texts, labels, scores):
+        # Adjust a (paragraphs x labels) score matrix based on explicit words
+        matrices = self.rule_matrices(labels)
+        hits = np.zeros((len(texts), len(self.keyword_index)), dtype=bool)
+        for row, text in enumerate(texts):
+            hits[row, [self.keyword_index[word] for word in self.matches(text)]] = True
+
+        scores = scores.copy()
+        # Set score to 0 if no must_have word is present
+        scores[matrices['must_have'].any(axis=0) & ~(hits @ matrices['must_have'])] = 0
+        # Increase score by 30% if an increase_if word is present
+        scores = np.where(hits @ matrices['increase_if'], scores * 1.3, scores)
+        # Decrease score by 50% if a decrease_if word is present
+        scores = np.where(hits @ matrices['decrease_if'], scores * 0.5, scores)
+        return scores
+
+
+def normalize_scores(scores):
+    # Min-max normalize every row to 0-100; rows where all scores are the same
+    # are set to 100.0 to avoid division by zero
+    min_scores = scores.min(axis=1, keepdims=True)
+    max_scores = scores.max(axis=1, keepdims=True)
+    spread = max_scores - min_scores
+    flat = spread == 0
+    normalized = (scores - min_scores) / np.where(flat, 1.0, spread) * 100.0
+    return np.where(flat, 100.0, normalized)
+
+
+class WindowClassifier:
+    # Sequence classifier that tokenizes each paragraph once and splits the ones
+    # longer than the model limit into overlapping token windows. torch and
+    # transformers are imported here rather than at the top of the script so
+    # --help, argument errors and daemon runs start without them. The model
+    # itself is loaded on first use, so a process that only hands work to
+    # worker processes never loads it.
+    COMBINE_METHODS = ('mean', 'max', 'weighted')
+    BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+
+    def __init__(self, model_dir, window_overlap, window_combine, backend='torch'):
+        from transformers import AutoConfig, AutoTokenizer
+        self.model_dir = model_dir
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, clean_up_tokenization_spaces=True)
+        # Windows are tokenized up front, so padding them later is intended
+        self.tokenizer.deprecation_warnings["Asking-to-pad-a-fast-tokenizer"] = True
+        self.config = AutoConfig.from_pretrained(model_dir)
+        self.labels = [self.config.id2label[i] for i in range(self.config.num_labels)]
+        self.max_length = min(self.tokenizer.model_max_length, self.config.max_position_embeddings)
+        self.window_overlap = window_overlap
+        self.window_combine = window_combine
+        self.backend = backend
+        self.model = None
+        self.session = None
+
+    @staticmethod
+    def onnx_path(model_dir, backend):
+        # Written by distilbert_export_onnx.py
+        name = 'model.int8.onnx' if backend == 'onnx-int8' else 'model.onnx'
+        return os.path.join(model_dir, 'onnx', name)
+
+    def load(self):
+        import torch
+        if self.backend in ('onnx', 'onnx-int8'):
+            try:
+                import onnxruntime
+            except ImportError:
+                raise SystemExit("The onnx backends need onnxruntime: pip3 install onnxruntime")
+            onnx_path = self.onnx_path(self.model_dir, self.backend)
+            if not os.path.exists(onnx_path):
+                raise SystemExit(f"{onnx_path} not found. Run distilbert_export_onnx.py first.")
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = torch.get_num_threads()
+            self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        else:
+            from transformers import AutoModelForSequenceClassification
+            self.model = AutoModelForSequenceClassification.from_pretrained(self.model_dir)
+            self.model.eval()
+            if self.backend == 'torch-int8':
+                # Dynamic int8 quantization of the linear layers
+                self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def cache_variant(self):
+        # Settings that change the probabilities, kept apart in the prediction cache
+        return f"rows:{self.backend}:windows:{self.max_length}:{self.window_overlap}:{self.window_combine}"
+
+    def tokenize(self, texts):
+        # Return (text index, input_ids) for every window of every text
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length,
+                                 stride=self.window_overlap, return_overflowing_tokens=True)
+        return list(zip(encoded['overflow_to_sample_mapping'], encoded['input_ids']))
+
+    def predict(self, windows):
+        # Label probabilities for a batch of windows, padded to its longest member
+        import torch
+        if self.model is None and self.session is None:
+            self.load()
+        batch = self.tokenizer.pad({'input_ids': windows}, return_tensors='pt')
+        if self.session is not None:
+            feed = {name: batch[name].numpy() for name in ('input_ids', 'attention_mask')}
+            logits = torch.from_numpy(self.session.run(['logits'], feed)[0])
+        else:
+            with torch.inference_mode():
+                logits = self.model(**batch).logits
+        return logits.float().softmax(dim=-1)
+
+    def combine(self, probabilities, lengths):
+        # Merge the window probabilities of one paragraph into a single row
+        import torch
+        if len(probabilities) == 1:
+            return probabilities[0]
+        stacked = torch.stack(probabilities)
+        if self.window_combine == 'max':
+            return stacked.max(dim=0).values
+        if self.window_combine == 'weighted':
+            weights = torch.tensor(lengths, dtype=stacked.dtype).unsqueeze(1)
+            return (stacked * weights).sum(dim=0) / weights.sum()
+        return stacked.mean(dim=0)
+
+
+def classify_in_batches(classifier, texts, batch_size, skip_long=False, progress=None):
+    # Returns one row of label probabilities (in classifier.labels order) per
+    # text, or None for texts skipped because they do not fit into a single
+    # window, together with the forward pass time spent on each text
+    outputs = [None] * len(texts)
+    seconds = [0.0] * len(texts)
+
+    # Tokenize once; long paragraphs become several overlapping windows
+    windows = classifier.tokenize(texts)
+    window_counts = {}
+    for index, _ in windows:
+        window_counts[index] = window_counts.get(index, 0) + 1
+    if skip_long:
+        windows = [(index, input_ids) for index, input_ids in windows if window_counts[index] == 1]
+        if progress is not None:
+            progress.update(sum(1 for count in window_counts.values() if count > 1))
+
+    # Sort windows by token length so each batch holds similarly sized inputs
+    # and padding stays small, then scatter results back to their paragraphs
+    windows.sort(key=lambda window: len(window[1]))
+    window_probabilities = {}
+    window_lengths = {}
+    for start in range(0, len(windows), batch_size):
+        bucket = windows[start:start + batch_size]
+        started = time.perf_counter()
+        probabilities = classifier.predict([input_ids for _, input_ids in bucket])
+        elapsed = (time.perf_counter() - started) / len(bucket)
+
+        finished = 0
+        for (index, input_ids), row in zip(bucket, probabilities):
+            window_probabilities.setdefault(index, []).append(row)
+            window_lengths.setdefault(index, []).append(len(input_ids))
+            seconds[index] += elapsed
+            if len(window_probabilities[index]) == window_counts[index]:
+                combined = classifier.combine(window_probabilities.pop(index), window_lengths.pop(index))
+                outputs[index] = combined.numpy()
+                finished += 1
+        if progress is not None:
+            progress.update(finished)
+    return outputs, seconds
+
+
+# Classifier of a worker process, created once by init_worker
+worker_classifier = None
+
+
+def init_worker(model_dir, window_overlap, window_combine, backend, threads):
+    global worker_classifier
+    import torch
+    # Bound intra-op threads so workers do not oversubscribe the cores
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    worker_classifier = WindowClassifier(model_dir, window_overlap, window_combine, backend)
+
+
+def classify_shard(task):
+    texts, batch_size, skip_long = task
+    started = time.perf_counter()
+    outputs, seconds = classify_in_batches(worker_classifier, texts, batch_size, skip_long)
+    return os.getpid(), outputs, seconds, time.perf_counter() - started
+
+
+def classify_texts(classifier, texts, batch_size, progress, cache=None, skip_long=False, pool=None, workers=1, worker_stats=None):
+    # Classify a chunk of paragraphs, serving what we can from the prediction
+    # cache and spreading the rest over the worker pool when there is one
+    outputs = [None] * len(texts)
+
+    # Paragraphs already in the prediction cache skip the forward pass
+    pending = list(range(len(texts)))
+    if cache is not None:
+        hits = cache.get_many(texts)
+        if skip_long and hits:
+            # An earlier run without -s may have cached long paragraphs; they are
+            # left to classify_in_batches, which skips them
+            hit_indices = list(hits)
+            window_counts = {}
+            for position, _ in classifier.tokenize([texts[index] for index in hit_indices]):
+                window_counts[position] = window_counts.get(position, 0) + 1
+            for position, index in enumerate(hit_indices):
+                if window_counts[position] > 1:
+                    del hits[index]
+        for index, row in hits.items():
+            outputs[index] = np.asarray(row, dtype=np.float32)
+        pending = [index for index in pending if outputs[index] is None]
+        progress.update(len(texts) - len(pending))
+    if not pending:
+        return outputs
+
+    pending_texts = [texts[index] for index in pending]
+    if pool is None:
+        pending_outputs, seconds = classify_in_batches(classifier, pending_texts, batch_size, skip_long, progress)
+    else:
+        # Several shards per worker keep every process busy until the end;
+        # imap hands the shards back in input order
+        shard_size = max(batch_size, -(-len(pending_texts) // (workers * 4)))
+        tasks = [(pending_texts[start:start + shard_size], batch_size, skip_long)
+                 for start in range(0, len(pending_texts), shard_size)]
+        pending_outputs = []
+        seconds = []
+        for pid, shard_outputs, shard_seconds, busy in pool.imap(classify_shard, tasks):
+            pending_outputs.extend(shard_outputs)
+            seconds.extend(shard_seconds)
+            stats = worker_stats.setdefault(pid, [0, 0.0])
+            stats[0] += len(shard_outputs)
+            stats[1] += busy
+            progress.update(len(shard_outputs))
+
+    for index, row in zip(pending, pending_outputs):
+        outputs[index] = row
+    if cache is not None:
+        cache.put_many([(texts[index], row, spent)
+                        for index, row, spent in zip(pending, pending_outputs, seconds)
+                        if row is not None])
+    return outputs
+
+
+def build_results(label_rules, labels, texts, rows, no_normalize, top_label, top_k=None):
+    # Turn the label probability rows of a chunk into infer_output.json entries
+    # (None where the row is None), keeping the top_k best labels when given.
+    # Scores stay in one (paragraphs x labels) matrix until the entries are built.
+    kept = [index for index, row in enumerate(rows) if row is not None]
+    results = [None] * len(texts)
+    if not kept:
+        return results
+    raw = np.array([rows[index] for index in kept], dtype=np.float64)
+    scores = label_rules.apply([texts[index] for index in kept], labels, raw)
+
+    # Normalize scores if -c argument is not passed
+    if not no_normalize:
+        scores = normalize_scores(scores)
+
+    # Sort labels by adjusted score in descending order; ties keep the order of
+    # the raw probabilities, then the label order
+    order = np.lexsort((-raw, -scores), axis=-1)[:, :top_k]
+    for row, index in enumerate(kept):
+        if top_label:
+            results[index] = {
+                'text': texts[index],
+                'label': labels[order[row, 0]]  # Only include the top label without score
+            }
+        else:
+            row_scores = scores[row].tolist()
+            results[index] = {
+                'text': texts[index],
+                'results': [{'label': labels[column], 'score': row_scores[column]} for column in order[row].tolist()]  # Include all sorted label probabilities
+            }
+    return results
+
+
+def member_result(label_rules, labels, row, result, paragraph, no_normalize, top_label, top_k=None):
+    # Result of a duplicate paragraph from the result and raw probability row
+    # of its representative. An exact copy reuses the result; a near-duplicate
+    # gets the keyword rules and normalization applied to its own text.
+    if result['text'] == paragraph:
+        return result
+    return build_results(label_rules, labels, [paragraph], [row], no_normalize, top_label, top_k)[0]
+
+
+def read_stream_progress(path):
+    # Return the last complete record of a streamed output file, cutting off a
+    # line that was only partially written when the previous run was killed
+    last_record = None
+    valid_size = 0
+    with open(path, 'rb') as stream:
+        for line in stream:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            last_record = record
+            valid_size += len(line)
+    with open(path, 'r+b') as stream:
+        stream.truncate(valid_size)
+    return last_record
+
+
+def stream_to_json(stream_path, json_path):
+    # Convert the JSONL stream into the infer_output.json layout one record at a
+    # time, producing the same text as json.dump(results, indent=2)
+    with open(stream_path, 'r') as stream, open(json_path, 'w') as outfile:
+        count = 0
+        for line in stream:
+            record = json.loads(line)
+            record.pop('paragraph', None)
+            outfile.write('[\n  ' if count == 0 else ',\n  ')
+            outfile.write(json.dumps(record, indent=2).replace('\n', '\n  '))
+            count += 1
+        outfile.write('\n]' if count else '[]')
+    return count
+
+
+def startup_benchmark(model_dir, args, texts, inputs_seconds):
+    # Time each phase of a cold start of this script
+    phases = [("Arguments and input files", inputs_seconds)]
+
+    # transformers only imports its submodules when a class is first used, so
+    # the classes the backend needs are looked up here to time their import
+    started = time.perf_counter()
+    import torch
+    import transformers
+    transformers.AutoConfig, transformers.AutoTokenizer
+    if args.backend in ('onnx', 'onnx-int8'):
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            raise SystemExit("The onnx backends need onnxruntime: pip3 install onnxruntime")
+        phase = "Import torch, transformers and onnxruntime"
+    else:
+        transformers.AutoModelForSequenceClassification
+        phase = "Import torch and transformers"
+    phases.append((phase, time.perf_counter() - started))
+
+    started = time.perf_counter()
+    classifier = WindowClassifier(model_dir, args.window_overlap, args.window_combine, args.backend)
+    phases.append(("Load tokenizer and config", time.perf_counter() - started))
+
+    started = time.perf_counter()
+    classifier.load()
+    phases.append((f"Load model ({args.backend})", time.perf_counter() - started))
+
+    batch = texts[:args.batch_size]
+    if batch:
+        started = time.perf_counter()
+        classify_in_batches(classifier, batch, args.batch_size)
+        phases.append((f"First batch ({len(batch)} paragraphs)", time.perf_counter() - started))
+    else:
+        print("No paragraphs to classify, the first batch is not timed")
+
+    print("Startup benchmark:")
+    for name, seconds in phases:
+        print(f"{name}: {seconds:.3f}s")
+    print(f"Total: {sum(seconds for _, seconds in phases):.3f}s")
+
+
+def main():
+    main_started = time.perf_counter()
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="DistilBERT Inference Script")
+    parser.add_argument('-c', '--no-normalize', action='store_true', help="Do not normalize scores")
+    parser.add_argument('-l', '--top-label', action='store_true', help="Only output the top label name")
+    parser.add_argument('-s', '--skip-long', action='store_true', help="Skip paragraphs exceeding the model's maximum token length instead of classifying them in windows")
+    parser.add_argument('-b', '--batch-size', type=int, default=32, help="Number of paragraphs classified per forward pass (default: 32)")
+    parser.add_argument('--stream', action='store_true', help="Append results to infer_output.jsonl while classifying and resume an interrupted run")
+    parser.add_argument('--flush-every', type=int, default=1000, help="Paragraphs classified between writes to infer_output.jsonl (default: 1000)")
+    parser.add_argument('--to-json', action='store_true', help="After a --stream run, also convert infer_output.jsonl into infer_output.json")
+    parser.add_argument('--top-k', type=int, metavar='K', help="Only keep the K best labels of every paragraph (default: all labels)")
+    parser.add_argument('--compact', action='store_true', help="Write the columnar infer_output.npz instead of infer_output.json")
+    parser.add_argument('--compact-dtype', choices=('float16', 'float32'), default='float16', help="Score type stored in infer_output.npz (default: float16)")
+    parser.add_argument('--window-overlap', type=int, default=64, help="Tokens shared by consecutive windows of a long paragraph (default: 64)")
+    parser.add_argument('--window-combine', choices=WindowClassifier.COMBINE_METHODS, default='weighted',
+                        help="How window scores of a long paragraph are combined (default: weighted by window length)")
+    parser.add_argument('--cache', action='store_true', help="Reuse model predictions for unchanged paragraphs from infer_cache.sqlite")
+    parser.add_argument('--cache-size', type=int, default=256, help="Maximum size of the prediction cache in MB (default: 256)")
+    parser.add_argument('--backend', choices=WindowClassifier.BACKENDS, default='torch',
+                        help="Model runtime: PyTorch fp32, PyTorch with dynamic int8 quantization, or an ONNX graph exported by distilbert_export_onnx.py (default: torch)")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="Number of worker processes, each with its own copy of the model (default: 1)")
+    parser.add_argument('--threads-per-worker', type=int, help="Intra-op threads per worker process (default: CPU cores divided by workers)")
+    parser.add_argument('--no-daemon', action='store_true', help="Load the model in this process even if distilbert_daemon.py is running")
+    parser.add_argument('--daemon-port', type=int, default=daemon_client.DEFAULT_PORT, help=f"Port of distilbert_daemon.py (default: {daemon_client.DEFAULT_PORT})")
+    parser.add_argument('--dedupe', action='store_true', help="Classify repeated paragraphs once and copy the result to every copy")
+    parser.add_argument('--near-duplicates', type=float, metavar='SIMILARITY',
+                        help="Also treat paragraphs whose estimated word-trigram Jaccard similarity reaches SIMILARITY (0-1) as copies")
+    parser.add_argument('--model-dir', default="trained_model_1", help="Model folder to classify with, e.g. a student from distilbert_distill.py (default: trained_model_1)")
+    parser.add_argument('--progress-fd', type=int, metavar='FD', help="Write JSON-lines progress events (phase, step, total, paragraphs/s, ETA) to this open file descriptor")
+    parser.add_argument('--startup-benchmark', action='store_true', help="Report the time spent in each startup phase (imports, model load, first batch) and exit")
+    args = parser.parse_args()
+
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.flush_every < 1:
+        parser.error("--flush-every must be at least 1")
+    if args.to_json and not args.stream:
+        parser.error("--to-json requires --stream")
+    if args.top_k is not None and args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+    if args.compact and args.stream and not args.to_json:
+        parser.error("--compact with --stream requires --to-json")
+    if args.window_overlap < 0:
+        parser.error("--window-overlap must not be negative")
+    if args.cache_size < 1:
+        parser.error("--cache-size must be at least 1")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.threads_per_worker is not None and args.threads_per_worker < 1:
+        parser.error("--threads-per-worker must be at least 1")
+    if args.near_duplicates is not None and not 0 < args.near_duplicates <= 1:
+        parser.error("--near-duplicates must be between 0 and 1")
+
+    stream_path = 'infer_output.jsonl'
+    model_dir = args.model_dir
+    events = ProgressEvents(args.progress_fd)
+
+    # Check every input before torch and transformers are loaded
+    if not os.path.isdir(model_dir):
+        parser.error(f"{model_dir} not found. Run distilbert_train.py first.")
+    for path in ('train_labels.json', 'infer_input.md'):
+        if not os.path.exists(path):
+            parser.error(f"{path} not found.")
+    if args.backend in ('onnx', 'onnx-int8') and not os.path.exists(WindowClassifier.onnx_path(model_dir, args.backend)):
+        parser.error(f"{WindowClassifier.onnx_path(model_dir, args.backend)} not found. Run distilbert_export_onnx.py first.")
+
+    # Load the labels with explicit words
+    with open('train_labels.json', 'r') as f:
+        labels_data = json.load(f)
+    label_rules = LabelRules(labels_data)
+    label_table = [labels_data[key]['label'] for key in sorted(labels_data, key=int)]
+
+    with open('infer_input.md', 'r') as file:
+        paragraphs = file.read().split('\n\n')
+
+    # Continue after the last paragraph already written by an interrupted stream
+    resume_after = 0
+    if args.stream and os.path.exists(stream_path):
+        last_record = read_stream_progress(stream_path)
+        if last_record is not None:
+            resume_after = last_record['paragraph']
+            if resume_after > len(paragraphs) or paragraphs[resume_after - 1] != last_record['text']:
+                print(f"{stream_path} does not match infer_input.md. Remove it to start a new run.")
+                exit(1)
+            if ('label' in last_record) != args.top_label:
+                print(f"{stream_path} was written with a different -l setting. Remove it to start a new run.")
+                exit(1)
+            if 'results' in last_record and len(last_record['results']) != min(args.top_k or len(label_table), len(label_table)):
+                print(f"{stream_path} was written with a different --top-k setting. Remove it to start a new run.")
+                exit(1)
+            print(f"Resuming after paragraph {resume_after} of {len(paragraphs)}.")
+
+    # Select the non-empty paragraphs to classify
+    selected = [(i, paragraph) for i, paragraph in enumerate(paragraphs, start=1) if i > resume_after and paragraph.strip()]
+
+    if args.startup_benchmark:
+        startup_benchmark(model_dir, args, [paragraph for _, paragraph in selected], time.perf_counter() - main_started)
+        return
+
+    # A running distilbert_daemon.py already has the model loaded, so use it
+    # when it serves this folder with the same model settings
+    daemon_status = None if args.no_daemon or args.workers > 1 else daemon_client.status(args.daemon_port)
+    daemon_options = {
+        'no_normalize': args.no_normalize,
+        'top_label': args.top_label,
+        'top_k': args.top_k,
+        'skip_long': args.skip_long,
+        'batch_size': args.batch_size,
+        'backend': args.backend,
+        'window_overlap': args.window_overlap,
+        'window_combine': args.window_combine
+    }
+    use_daemon = daemon_client.matches(daemon_status, model_dir, args.backend, args.window_overlap, args.window_combine)
+    if use_daemon:
+        print(f"Using the inference daemon on port {args.daemon_port}.")
+
+    def load_classifier():
+        # The classifier returns all label probabilities; it is only needed
+        # when this process runs the model itself
+        classifier = WindowClassifier(model_dir, args.window_overlap, args.window_combine, args.backend)
+        if args.window_overlap > classifier.max_length // 2:
+            parser.error(f"--window-overlap must be at most {classifier.max_length // 2}")
+        cache = PredictionCache('infer_cache.sqlite', model_dir, labels_data, args.cache_size << 20, classifier.cache_variant()) if args.cache else None
+        return classifier, cache
+
+    events.start('load')
+    classifier, cache = (None, None) if use_daemon else load_classifier()
+
+    # Worker processes are spawned rather than forked so none of them inherits
+    # the thread pools of this process
+    pool = None
+    worker_stats = {}
+    if args.workers > 1 and not use_daemon:
+        threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+        pool = multiprocessing.get_context('spawn').Pool(
+            args.workers, initializer=init_worker,
+            initargs=(model_dir, args.window_overlap, args.window_combine, args.backend, threads))
+        print(f"Started {args.workers} workers with {threads} threads each.")
+    elif args.threads_per_worker is not None:
+        import torch
+        torch.set_num_threads(args.threads_per_worker)
+
+    # Collapse duplicate paragraphs so every group is classified only once and
+    # its probabilities are reused for the other members. Representatives always
+    # come first, so a result is only kept until its last member has been written.
+    representatives = list(range(len(selected)))
+    if args.dedupe or args.near_duplicates is not None:
+        representatives = group_duplicates([paragraph for _, paragraph in selected], args.near_duplicates)
+    last_member = {}
+    for position, representative in enumerate(representatives):
+        last_member[representative] = position
+    representative_results = {}
+
+    # Without --stream everything is classified as one chunk and written at the end
+    chunk_size = args.flush_every if args.stream else max(len(selected), 1)
+    # --compact keeps the results in columns instead of one dictionary per paragraph
+    results = CompactWriter(label_table, args.compact_dtype) if args.compact else []
+    add_result = results.add if args.compact else results.append
+    skipped_long = 0
+    stream = open(stream_path, 'a') if args.stream else None
+    started = time.perf_counter()
+    with events.track(tqdm(total=len(selected), desc="Processing paragraphs"), 'infer') as progress:
+        for start in range(0, len(selected), chunk_size):
+            positions = range(start, min(start + chunk_size, len(selected)))
+            new_representatives = [position for position in positions if representatives[position] == position]
+            texts = [selected[position][1] for position in new_representatives]
+            # The raw probability rows are kept, so near-duplicate members can
+            # get the keyword rules of their own text
+            rows = None
+            if use_daemon and texts:
+                done_before = progress.n
+                try:
+                    response = daemon_client.classify(texts, {**daemon_options, 'rows': True}, args.daemon_port,
+                                                      lambda done, total: progress.update(done_before + done - progress.n))
+                    rows = [None if row is None else np.asarray(row, dtype=np.float32) for row in response['rows']]
+                    row_labels = response['labels']
+                except daemon_client.DaemonUnavailable as e:
+                    print(f"Inference daemon unavailable ({e}), loading the model locally.")
+                    use_daemon = False
+                    progress.update(done_before - progress.n)
+                    classifier, cache = load_classifier()
+            if rows is None and texts:
+                rows = classify_texts(classifier, texts, args.batch_size, progress, cache,
+                                      args.skip_long, pool, args.workers, worker_stats)
+                row_labels = classifier.labels
+            if texts:
+                chunk_results = build_results(label_rules, row_labels, texts, rows, args.no_normalize, args.top_label, args.top_k)
+                representative_results.update(zip(new_representatives, [(result, row, row_labels) for result, row in zip(chunk_results, rows)]))
+            progress.update(len(positions) - len(new_representatives))
+
+            for position in positions:
+                i, paragraph = selected[position]
+                representative = representatives[position]
+                result, row, row_labels = representative_results[representative]
+                if last_member[representative] == position:
+                    del representative_results[representative]
+                if result is None:
+                    skipped_long += 1
                     continue
+                if representative != position:
+                    result = member_result(label_rules, row_labels, row, result, paragraph, args.no_normalize, args.top_label, args.top_k)
+                if stream is None:
+                    add_result(result)
                 else:
-                    print("Invalid input. Continuing to next paragraph.")
-                    continue
-        
-        classifications = classifier(paragraph)  # Get the list of all label probabilities
-        # Adjust scores based on explicit words
-        for class_list in classifications:
-            for classification in class_list:
-                label = classification['label']
-                label_index = next((index for index, data in labels_data.items() if data['label'] == label), None)
-                if label_index is not None:
-                    label_data = labels_data[label_index]
-                    increase_if_words = label_data['increase_if']
-                    decrease_if_words = label_data['decrease_if']
-                    must_have_words = label_data['must_have']
-                    
-                    # Check for must_have words
-                    if must_have_words:
-                        if not any(word.lower() in paragraph.lower() for word in must_have_words):
-                            classification['score'] = 0  # Set score to 0 if no must_have word is present
-                    
-                    # Check for increase_if words
-                    if increase_if_words:
-                        if any(word.lower() in paragraph.lower() for word in increase_if_words):
-                            classification['score'] *= 1.3  # Increase score by 30%
-                    
-                    # Check for decrease_if words
-                    if decrease_if_words:
-                        if any(word.lower() in paragraph.lower() for word in decrease_if_words):
-                            classification['score'] *= 0.5  # Decrease score by 50%
-
-        # Normalize scores if -c argument is not passed
-        if not args.no_normalize:
-            for class_list in classifications:
-                if class_list:  # Check if the list is not empty
-                    scores = [classification['score'] for classification in class_list]
-                    min_score = min(scores)
-                    max_score = max(scores)
-                    
-                    # Avoid division by zero
-                    if max_score != min_score:
-                        for classification in class_list:
-                            normalized_score = (classification['score'] - min_score) / (max_score - min_score) * 100.0
-                            classification['score'] = normalized_score
-                    else:
-                        # If all scores are the same, set them to 100.0
-                        for classification in class_list:
-                            classification['score'] = 100.0
-
-        # Sort the classifications by normalized score in descending order
-        sorted_classifications = sorted(classifications[0], key=lambda x: x['score'], reverse=True)
-        if args.top_label:
-            results.append({
-                'text': paragraph,
-                'label': sorted_classifications[0]['label']  # Only include the top label without score
-            })
-        else:
-            results.append({
-                'text': paragraph,
-                'results': sorted_classifications  # Include all sorted label probabilities
-            })
+                    stream.write(json.dumps({'paragraph': i, **result}) + '\n')
+            if stream is not None:
+                stream.flush()
+                os.fsync(stream.fileno())
+    elapsed = time.perf_counter() - started
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+        print(f"Classified {len(selected)} paragraphs in {elapsed:.1f}s ({len(selected) / max(elapsed, 1e-9):.1f} paragraphs/s)")
+        for number, (pid, (count, busy)) in enumerate(sorted(worker_stats.items()), start=1):
+            print(f"Worker {number} (pid {pid}): {count} paragraphs in {busy:.1f}s ({count / max(busy, 1e-9):.1f} paragraphs/s)")
+
+    if args.dedupe or args.near_duplicates is not None:
+        exact = sum(1 for position, representative in enumerate(representatives)
+                    if representative != position and selected[position][1] == selected[representative][1])
+        near = sum(1 for position, representative in enumerate(representatives) if representative != position) - exact
+        print(f"Duplicates: {exact} exact and {near} near-duplicate paragraphs reused another paragraph's result, "
+              f"saving {exact + near} of {len(selected)} forward passes.")
+
+    if skipped_long:
+        print(f"Skipped {skipped_long} paragraphs exceeding the maximum length of the model.")
+
+    if cache is not None:
+        print(cache.summary())
+        cache.close()
+
+    events.start('save')
+    if args.compact and stream is None:
+        results.save('infer_output.npz')
+        print(f"Classification complete. Results written to infer_output.npz")
+    elif stream is None:
+        with open('infer_output.json', 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+        print(f"Classification complete. Results written to infer_output.json")
+    else:
+        stream.close()
+        print(f"Classification complete. Results written to {stream_path}")
+        if args.to_json and args.compact:
+            count = stream_to_compact(stream_path, 'infer_output.npz', label_table, args.compact_dtype)
+            print(f"Converted {count} results to infer_output.npz")
+        elif args.to_json:
+            count = stream_to_json(stream_path, 'infer_output.json')
+            print(f"Converted {count} results to infer_output.json")
+    events.start('done')
+    events.close()
 
-with open('infer_output.json', 'w') as outfile:
-    json.dump(results, outfile, indent=2)
 
-print(f"Classification complete. Results written to infer_output.json")
+if __name__ == '__main__':
+    main()
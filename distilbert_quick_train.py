@@ -0,0 +1,154 @@
+# this script will train a quick preview model in seconds instead of fine-tuning DistilBERT with distilbert_train.py
+# every paragraph of train_input.json is embedded once with the frozen encoder (cached in embedding_cache.sqlite by text)
+# and only a logistic regression head is fitted on the embeddings
+# long paragraphs are split into the same token windows as in distilbert_infer.py, so the head is fitted on the features it sees there
+# the head is written into a regular DistilBERT classification model, so distilbert_infer.py --model-dir quick_model
+# uses it with the same output format and keyword rules
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+import torch
+from sklearn.linear_model import LogisticRegression
+from transformers import AutoConfig, AutoModel, AutoTokenizer, AutoModelForSequenceClassification
+from distilbert_infer import WindowClassifier
+from prediction_cache import PredictionCache
+
+
+def embed(model, windowing, texts, batch_size):
+    # Hidden state of the first ([CLS]) token of every token window, which the
+    # DistilBERT classification head reads. Returns one cache row per text:
+    # the token count of each window followed by its vector, window after window.
+    windows = windowing.tokenize(texts)
+    windows.sort(key=lambda window: len(window[1]))
+    rows = [[] for _ in texts]
+    model.eval()
+    with torch.no_grad():
+        for start in range(0, len(windows), batch_size):
+            bucket = windows[start:start + batch_size]
+            inputs = windowing.tokenizer.pad({'input_ids': [input_ids for _, input_ids in bucket]}, return_tensors='pt')
+            for (index, input_ids), vector in zip(bucket, model(**inputs).last_hidden_state[:, 0].tolist()):
+                rows[index] += [len(input_ids)] + vector
+    return rows
+
+
+def split_windows(row, size):
+    # (token count, vector) of every window in a cache row written by embed
+    return [(row[start], row[start + 1:start + 1 + size]) for start in range(0, len(row), size + 1)]
+
+
+def encoder_files(encoder):
+    # Local folder of the encoder, for the cache fingerprint
+    if os.path.isdir(encoder):
+        return encoder
+    from huggingface_hub import snapshot_download
+    return snapshot_download(encoder, local_files_only=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DistilBERT Quick Training Script")
+    parser.add_argument('--encoder', default="distilbert/distilbert-base-uncased", help="Frozen encoder used for the embeddings (default: distilbert/distilbert-base-uncased)")
+    parser.add_argument('--output-dir', default="quick_model", help="Folder the quick model is saved to (default: quick_model)")
+    parser.add_argument('-C', '--regularization', type=float, default=1.0, help="Inverse regularization strength of the logistic regression (default: 1.0)")
+    parser.add_argument('-b', '--batch-size', type=int, default=32, help="Token windows embedded per forward pass (default: 32)")
+    parser.add_argument('--window-overlap', type=int, default=64, help="Tokens shared by consecutive windows of a long paragraph, as distilbert_infer.py --window-overlap (default: 64)")
+    parser.add_argument('--cache-size', type=int, default=1024, help="Maximum size of embedding_cache.sqlite in MB (default: 1024)")
+    args = parser.parse_args()
+
+    if args.window_overlap < 0:
+        parser.error("--window-overlap must not be negative")
+
+    with open('train_labels.json', 'r') as f:
+        id2label = {int(k): v['label'] for k, v in json.load(f).items()}
+    label2id = {v: k for k, v in id2label.items()}
+    num_labels = len(id2label)
+
+    with open('train_input.json', 'r') as file:
+        train_dataset = json.load(file)
+    texts = [item['text'] for item in train_dataset]
+    labels = np.array([item['label'] for item in train_dataset])
+
+    started = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(args.encoder, clean_up_tokenization_spaces=True)
+    encoder = AutoModel.from_pretrained(args.encoder)
+    windowing = WindowClassifier(args.encoder, args.window_overlap, 'weighted')
+    if args.window_overlap > windowing.max_length // 2:
+        parser.error(f"--window-overlap must be at most {windowing.max_length // 2}")
+
+    # Embeddings only depend on the text, the encoder files and the windowing
+    cache = PredictionCache('embedding_cache.sqlite', encoder_files(args.encoder), {}, args.cache_size << 20,
+                            f"cls-windows:{windowing.max_length}:{args.window_overlap}")
+    rows = cache.get_many(texts)
+    missing = [index for index in range(len(texts)) if index not in rows]
+    if missing:
+        embed_started = time.perf_counter()
+        new_rows = embed(encoder, windowing, [texts[index] for index in missing], args.batch_size)
+        seconds = (time.perf_counter() - embed_started) / len(missing)
+        cache.put_many([(texts[index], row, seconds) for index, row in zip(missing, new_rows)])
+        rows.update(zip(missing, new_rows))
+    print(cache.summary())
+    cache.close()
+
+    # Every window is a training example with its paragraph's label, weighted
+    # by its share of the paragraph's tokens like --window-combine weighted
+    paragraph_of = []
+    window_features = []
+    weights = []
+    for index in range(len(texts)):
+        windows = split_windows(rows[index], encoder.config.hidden_size)
+        total = sum(length for length, _ in windows)
+        for length, vector in windows:
+            paragraph_of.append(index)
+            window_features.append(vector)
+            weights.append(length / total)
+    features = np.array(window_features, dtype=np.float64)
+    paragraph_of = np.array(paragraph_of)
+    weights = np.array(weights)
+    embed_seconds = time.perf_counter() - started
+
+    # Standardized features help the solver; the scaling is folded back into the weights below
+    mean = features.mean(axis=0)
+    std = features.std(axis=0) + 1e-6
+    fit_started = time.perf_counter()
+    head = LogisticRegression(C=args.regularization, max_iter=1000)
+    head.fit((features - mean) / std, labels[paragraph_of], sample_weight=weights)
+    fit_seconds = time.perf_counter() - fit_started
+
+    # Paragraph predictions combine the window probabilities as distilbert_infer.py does
+    probabilities = np.zeros((len(texts), len(head.classes_)))
+    np.add.at(probabilities, paragraph_of, head.predict_proba((features - mean) / std) * weights[:, None])
+    accuracy = (head.classes_[probabilities.argmax(axis=1)] == labels).mean()
+    print(f"Training accuracy: {accuracy * 100:.2f}% ({len(features)} windows of {len(texts)} paragraphs)")
+
+    # Logits for every label id; labels without examples get a large negative bias
+    coef = head.coef_ if len(head.classes_) > 2 else np.vstack([np.zeros_like(head.coef_), head.coef_])
+    intercept = head.intercept_ if len(head.classes_) > 2 else np.concatenate([[0.0], head.intercept_])
+    weight = np.zeros((num_labels, features.shape[1]))
+    bias = np.full(num_labels, -30.0)
+    for row, label in enumerate(head.classes_):
+        weight[label] = coef[row] / std
+        bias[label] = intercept[row] - coef[row] @ (mean / std)
+
+    # DistilBERT's head is classifier(relu(pre_classifier(cls))). pre_classifier
+    # becomes the identity plus a shift that keeps every input positive, so the
+    # ReLU passes it through; the classifier bias subtracts the shift again.
+    shift = 4 * float(np.abs(features).max()) + 1
+    config = AutoConfig.from_pretrained(args.encoder, num_labels=num_labels, id2label=id2label, label2id=label2id,
+                                        problem_type="single_label_classification")
+    model = AutoModelForSequenceClassification.from_pretrained(args.encoder, config=config, ignore_mismatched_sizes=True)
+    with torch.no_grad():
+        model.pre_classifier.weight.copy_(torch.eye(features.shape[1]))
+        model.pre_classifier.bias.fill_(shift)
+        model.classifier.weight.copy_(torch.tensor(weight))
+        model.classifier.bias.copy_(torch.tensor(bias - weight.sum(axis=1) * shift))
+    model.save_pretrained(args.output_dir)
+    tokenizer.save_pretrained(args.output_dir)
+
+    print(f"Embedded {len(texts)} paragraphs ({len(missing)} new) in {embed_seconds:.1f}s, fitted the head in {fit_seconds:.2f}s")
+    print(f"Saved the quick model to {args.output_dir}. Use it with: python3 distilbert_infer.py --model-dir {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+# this script will search for good training settings of distilbert_train.py on a held-out split of train_input.json
+# trials run in parallel worker processes, each with its own share of the CPU threads, on one shared tokenized dataset
+# poor trials are stopped early by successive halving: all trials train a few epochs, the best 1/eta continue, and so on
+# the result is a table of the trials ranked by hold-out F1 score with their wall-clock time (also saved to sweep_results.json)
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import time
+
+BASE_MODEL = "distilbert/distilbert-base-uncased"
+RUN_DIR = 'sweep_runs'
+PARAMETERS = ('learning_rate', 'batch_size', 'weight_decay', 'warmup_ratio')
+DEFAULTS = {'learning_rate': 2e-5, 'batch_size': 8, 'weight_decay': 0.01, 'warmup_ratio': 0.0}
+DEFAULT_SPEC = {'learning_rate': [1e-5, 2e-5, 5e-5], 'batch_size': [8, 16], 'weight_decay': [0.0, 0.01]}
+
+
+def init_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+
+
+def run_trial(task):
+    # Train one trial up to task['epochs'] epochs, continuing from its checkpoint
+    # of the previous rung, and return its hold-out metrics
+    from datasets import Dataset
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification, DataCollatorWithPadding
+    from transformers import TrainerCallback, TrainingArguments, Trainer
+    from transformers.trainer_callback import PrinterCallback
+    from distilbert_train import compute_metrics
+
+    class StopAtEpochCallback(TrainerCallback):
+        # Only the checkpoint at the end of the rung is saved
+        def on_epoch_end(self, args, state, control, **kwargs):
+            control.should_save = round(state.epoch) >= task['epochs']
+            control.should_training_stop = control.should_save
+
+    started = time.perf_counter()
+    dataset = Dataset.load_from_disk(task['dataset_path'])
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, clean_up_tokenization_spaces=True)
+    id2label = {int(k): v for k, v in task['id2label'].items()}
+    model = AutoModelForSequenceClassification.from_pretrained(
+        BASE_MODEL,
+        num_labels=len(id2label),
+        id2label=id2label,
+        label2id={v: k for k, v in id2label.items()},
+        problem_type="single_label_classification"
+    )
+    params = task['params']
+    training_args = TrainingArguments(
+        output_dir=task['output_dir'],
+        save_strategy="epoch",
+        save_total_limit=1,
+        learning_rate=params['learning_rate'],
+        per_device_train_batch_size=params['batch_size'],
+        weight_decay=params['weight_decay'],
+        warmup_ratio=params['warmup_ratio'],
+        num_train_epochs=task['max_epochs'],  # Same schedule whichever rung a trial stops at
+        group_by_length=True,
+        length_column_name='length',
+        disable_tqdm=True,
+        report_to=[]
+    )
+    trainer = Trainer(
+        model=model,
+        args=training_args,
+        train_dataset=dataset.select(task['train_indices']),
+        eval_dataset=dataset.select(task['eval_indices']),
+        data_collator=DataCollatorWithPadding(tokenizer=tokenizer),
+        tokenizer=tokenizer,
+        compute_metrics=compute_metrics,
+        callbacks=[StopAtEpochCallback()]
+    )
+    trainer.remove_callback(PrinterCallback)  # Only the summary line of every trial is printed
+    checkpoint = None
+    if os.path.isdir(task['output_dir']):
+        checkpoints = [name for name in os.listdir(task['output_dir']) if name.startswith("checkpoint-")]
+        if checkpoints:
+            checkpoint = os.path.join(task['output_dir'], max(checkpoints, key=lambda name: int(name.split('-')[1])))
+    trainer.train(resume_from_checkpoint=checkpoint)
+    metrics = trainer.evaluate()
+    return {
+        'trial': task['trial'],
+        'epochs': task['epochs'],
+        'f1': metrics['eval_f1'],
+        'accuracy': metrics['eval_accuracy'],
+        'seconds': time.perf_counter() - started
+    }
+
+
+def sample_value(values, generator):
+    # A list of choices, or a range {"min": .., "max": .., "log": true|false}
+    if isinstance(values, list):
+        return generator.choice(values)
+    if values.get('log'):
+        return math.exp(generator.uniform(math.log(values['min']), math.log(values['max'])))
+    return generator.uniform(values['min'], values['max'])
+
+
+def build_trials(spec, random_trials, seed=42):
+    unknown = set(spec) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown parameters in the spec: {', '.join(sorted(unknown))} (known: {', '.join(PARAMETERS)})")
+    if random_trials is None:
+        if not all(isinstance(values, list) for values in spec.values()):
+            raise ValueError("A grid search needs a list of values for every parameter; use --random N for ranges")
+        names = list(spec)
+        combinations = itertools.product(*(spec[name] for name in names))
+        trials = [{**DEFAULTS, **dict(zip(names, values))} for values in combinations]
+    else:
+        generator = random.Random(seed)
+        trials = [{**DEFAULTS, **{name: sample_value(values, generator) for name, values in spec.items()}}
+                  for _ in range(random_trials)]
+    for trial in trials:
+        trial['batch_size'] = int(trial['batch_size'])
+    return trials
+
+
+def rung_epochs(min_epochs, eta, max_epochs):
+    # Epoch budgets of the successive halving rungs, e.g. 2, 6, 16
+    epochs = [min_epochs]
+    while epochs[-1] < max_epochs:
+        epochs.append(min(epochs[-1] * eta, max_epochs))
+    return epochs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DistilBERT Hyperparameter Sweep Script")
+    parser.add_argument('-s', '--spec', help="JSON file mapping parameters (learning_rate, batch_size, weight_decay, warmup_ratio) to lists of values, "
+                                             "or with --random to {\"min\", \"max\", \"log\"} ranges (default: a small learning rate, batch size and weight decay grid)")
+    parser.add_argument('--random', type=int, metavar='N', help="Sample N random trials from the spec instead of running the full grid")
+    parser.add_argument('-w', '--workers', type=int, help="Trials trained at the same time (default: CPU cores divided by --threads-per-trial)")
+    parser.add_argument('--threads-per-trial', type=int, help="Intra-op threads of every trial (default: CPU cores divided by --workers, or 2)")
+    parser.add_argument('--eval-split', type=float, default=0.2, help="Fraction of every label held out to score the trials (default: 0.2)")
+    parser.add_argument('--max-epochs', type=int, default=16, help="Epochs of the trials that survive every rung (default: 16)")
+    parser.add_argument('--min-epochs', type=int, default=2, help="Epochs every trial trains before the first cut (default: 2)")
+    parser.add_argument('--eta', type=int, default=3, help="Only the best 1/eta of the trials continue after each rung (default: 3)")
+    args = parser.parse_args()
+
+    if args.random is not None and args.random < 1:
+        parser.error("--random must be at least 1")
+    if not 0 < args.eval_split < 1:
+        parser.error("--eval-split must be between 0 and 1")
+    if args.min_epochs < 1 or args.max_epochs < args.min_epochs:
+        parser.error("--min-epochs must be at least 1 and at most --max-epochs")
+    if args.eta < 2:
+        parser.error("--eta must be at least 2")
+
+    spec = DEFAULT_SPEC
+    if args.spec:
+        with open(args.spec, 'r') as f:
+            spec = json.load(f)
+    try:
+        trials = build_trials(spec, args.random)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Split the cores between the trials that run at the same time
+    cores = os.cpu_count() or 1
+    if args.workers is None:
+        threads = args.threads_per_trial or 2
+        workers = max(1, cores // threads)
+    else:
+        workers = args.workers
+        threads = args.threads_per_trial or max(1, cores // workers)
+    workers = max(1, min(workers, len(trials)))
+
+    from transformers import AutoTokenizer
+    from distilbert_train import stratified_split, tokenize_training_set
+
+    with open('train_labels.json', 'r') as f:
+        id2label = {int(k): v['label'] for k, v in json.load(f).items()}
+    with open('train_input.json', 'r') as file:
+        train_dataset = json.load(file)
+    texts = [item['text'] for item in train_dataset]
+    labels = [item['label'] for item in train_dataset]
+
+    # Tokenize once; every worker memory-maps the same Arrow files
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, clean_up_tokenization_spaces=True)
+    tokenized_dataset, _ = tokenize_training_set(tokenizer, texts, labels, id2label)
+    dataset_path = os.path.dirname(tokenized_dataset.cache_files[0]['filename'])
+    train_indices, eval_indices = stratified_split(labels, args.eval_split)
+    if not eval_indices:
+        parser.error("--eval-split leaves no examples for evaluation; use a larger fraction or more examples")
+
+    if os.path.exists(RUN_DIR):
+        shutil.rmtree(RUN_DIR)
+    rungs = rung_epochs(args.min_epochs, args.eta, args.max_epochs)
+    print(f"{len(trials)} trials, {workers} at a time with {threads} threads each, "
+          f"successive halving at {', '.join(str(epochs) for epochs in rungs)} epochs")
+
+    results = {index: {'trial': index, 'params': params, 'epochs': 0, 'f1': None, 'accuracy': None, 'seconds': 0.0}
+               for index, params in enumerate(trials, start=1)}
+    alive = list(results)
+    started = time.perf_counter()
+    pool = multiprocessing.get_context('spawn').Pool(workers, initializer=init_worker, initargs=(threads,), maxtasksperchild=1)
+    try:
+        for rung, epochs in enumerate(rungs):
+            tasks = [{
+                'trial': trial,
+                'params': results[trial]['params'],
+                'epochs': epochs,
+                'max_epochs': args.max_epochs,
+                'dataset_path': dataset_path,
+                'train_indices': train_indices,
+                'eval_indices': eval_indices,
+                'id2label': id2label,
+                'output_dir': os.path.join(RUN_DIR, f"trial-{trial}")
+            } for trial in alive]
+            for result in pool.imap_unordered(run_trial, tasks):
+                entry = results[result['trial']]
+                entry.update(epochs=result['epochs'], f1=result['f1'], accuracy=result['accuracy'])
+                entry['seconds'] += result['seconds']
+                print(f"Trial {result['trial']}: F1 {result['f1']:.4f} after {result['epochs']} epochs "
+                      f"({entry['seconds']:.1f}s)", flush=True)
+            if rung < len(rungs) - 1:
+                alive.sort(key=lambda trial: results[trial]['f1'], reverse=True)
+                stopped = alive[max(1, len(alive) // args.eta):]
+                alive = alive[:max(1, len(alive) // args.eta)]
+                for trial in stopped:
+                    shutil.rmtree(os.path.join(RUN_DIR, f"trial-{trial}"), ignore_errors=True)
+    except BaseException:
+        # Stop the running workers now instead of waiting for their training to finish
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+        shutil.rmtree(RUN_DIR, ignore_errors=True)
+
+    # Trials that went further rank first, then by hold-out F1 score
+    ranked = sorted(results.values(), key=lambda entry: (entry['epochs'], entry['f1']), reverse=True)
+    print(f"\nSweep finished in {time.perf_counter() - started:.1f}s ({len(train_indices)} training and {len(eval_indices)} held-out examples)\n")
+    print(f"{'Rank':>4}  {'F1':>6}  {'Accuracy':>8}  {'Epochs':>6}  {'Time':>8}  Parameters")
+    for rank, entry in enumerate(ranked, start=1):
+        params = ', '.join(f"{name}={entry['params'][name]:g}" for name in PARAMETERS)
+        print(f"{rank:>4}  {entry['f1']:>6.4f}  {entry['accuracy']:>8.4f}  {entry['epochs']:>6}  {entry['seconds']:>7.1f}s  {params}")
+
+    with open('sweep_results.json', 'w') as f:
+        json.dump(ranked, f, indent=2)
+    print("\nResults written to sweep_results.json")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,71 +1,527 @@
+import argparse
+import hashlib
 import json
 import os
+import random
+import re
 import shutil
+import psutil
+import torch
+from sklearn.metrics import precision_recall_fscore_support
+from torch.utils.data import DataLoader, Sampler
 from transformers import AutoTokenizer
-from datasets import Dataset
 from transformers import DataCollatorWithPadding
 from transformers import AutoModelForSequenceClassification, TrainingArguments, Trainer
+from transformers import EarlyStoppingCallback, TrainerCallback
+from progress_events import ProgressEvents
+from tokenization_cache import load_tokenized_dataset
 
-with open('train_labels.json', 'r') as f:
-    data = json.load(f)
-
-id2label = {int(k): v['label'] for k, v in data.items()}
-label2id = {v: k for k, v in id2label.items()}
-num_labels = len(id2label)
-
-with open('train_input.json', 'r') as file:
-    train_dataset = json.load(file)
-
-# Convert the list of dictionaries to separate lists for text and labels
-train_dict = {
-    'text': [item['text'] for item in train_dataset],
-    'label': [item['label'] for item in train_dataset]
-}
-
-dataset = Dataset.from_dict(train_dict)
-
-tokenizer = AutoTokenizer.from_pretrained("distilbert/distilbert-base-uncased", clean_up_tokenization_spaces=True)
-def preprocess_function(examples):
-    return tokenizer(examples["text"], truncation=True, padding=True)
-tokenized_dataset = dataset.map(preprocess_function, batched=True)
-
-data_collator = DataCollatorWithPadding(tokenizer=tokenizer)
-
-# Delete existing model if it exists
-output_dir = "trained_model_1"
-if os.path.exists(output_dir):
-    shutil.rmtree(output_dir)
-
-model = AutoModelForSequenceClassification.from_pretrained(
-    "distilbert/distilbert-base-uncased", 
-    num_labels=num_labels, 
-    id2label=id2label, 
-    label2id=label2id,
-    problem_type="single_label_classification"
-)
-
-training_args = TrainingArguments(
-    output_dir=output_dir,
-    save_strategy="epoch",
-    save_total_limit=1,  # Keep only the last checkpoint
-    learning_rate=2e-5,
-    per_device_train_batch_size=8,
-    num_train_epochs=16,
-    weight_decay=0.01
-)
-
-trainer = Trainer(
-    model=model,
-    args=training_args,
-    train_dataset=tokenized_dataset,
-    data_collator=data_collator,
-    tokenizer=tokenizer
-)
-
-trainer.train()
-
-# Move the last checkpoint to the main save directory and remove the subfolder
-last_checkpoint_dir = max([os.path.join(output_dir, d) for d in os.listdir(output_dir) if d.startswith("checkpoint-")], key=os.path.getmtime)
-for filename in os.listdir(last_checkpoint_dir):
-    shutil.move(os.path.join(last_checkpoint_dir, filename), output_dir)
-shutil.rmtree(last_checkpoint_dir)
+
+RUN_DIR = 'training_run'
+FAST_CPU_ACCUMULATION = 2  # Micro-batches per batch with --profile fast-cpu
+COMPLETE_MARKER = 'checkpoint_complete.json'
+
+
+class TokenBudgetBatchSampler(Sampler):
+    # Batches of paragraphs with similar token lengths whose padded size
+    # (longest paragraph x paragraphs) stays within max_tokens. Paragraphs are
+    # sorted by length, so every epoch packs the same number of batches; ties
+    # are broken at random and the batch order is shuffled every epoch.
+    def __init__(self, lengths, max_tokens, seed):
+        self.lengths = torch.tensor(lengths)
+        self.max_tokens = max_tokens
+        self.seed = seed
+        self.epoch = 0
+        self.batch_count = len(self.batches(torch.Generator().manual_seed(seed)))
+
+    def batches(self, generator):
+        shuffled = torch.randperm(len(self.lengths), generator=generator)
+        order = shuffled[torch.argsort(self.lengths[shuffled], stable=True)].tolist()
+        lengths = self.lengths.tolist()
+        batches = []
+        batch = []
+        for index in order:
+            # Sorted ascending, so the current paragraph is the longest of the batch
+            if batch and lengths[index] * (len(batch) + 1) > self.max_tokens:
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def set_epoch(self, epoch):
+        # Called by SamplerEpochCallback before every epoch, so a resumed run
+        # shuffles like an uninterrupted one
+        self.epoch = epoch
+
+    def __iter__(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        batches = self.batches(generator)
+        for position in torch.randperm(len(batches), generator=generator).tolist():
+            yield batches[position]
+
+    def __len__(self):
+        return self.batch_count
+
+
+class SamplerEpochCallback(TrainerCallback):
+    # accelerate only forwards set_epoch to samplers of the standard batch
+    # sampler, so the epoch number is passed to TokenBudgetBatchSampler here
+    def __init__(self, trainer):
+        self.trainer = trainer
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        if self.trainer.batch_sampler is not None:
+            self.trainer.batch_sampler.set_epoch(round(state.epoch))
+
+
+class TokenBudgetTrainer(Trainer):
+    # Trainer whose training batches come from TokenBudgetBatchSampler
+    def __init__(self, *args, max_tokens, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_tokens = max_tokens
+        self.batch_sampler = None
+        self.add_callback(SamplerEpochCallback(self))
+
+    def get_train_dataloader(self):
+        self.batch_sampler = TokenBudgetBatchSampler(self.train_dataset['length'], self.max_tokens, self.args.seed)
+        train_dataset = self._remove_unused_columns(self.train_dataset, description="training")
+        return self.accelerator.prepare(DataLoader(
+            train_dataset,
+            batch_sampler=self.batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory
+        ))
+
+
+class MetricsFileCallback(TrainerCallback):
+    # Writes the hold-out metrics of every epoch to train_metrics.json, so the
+    # GUI can show them while training is still running
+    def __init__(self, path, summary):
+        self.path = path
+        self.summary = summary
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        self.summary['epochs'].append({
+            'epoch': round(state.epoch),
+            'step': state.global_step,
+            'loss': metrics['eval_loss'],
+            'accuracy': metrics['eval_accuracy'],
+            'precision': metrics['eval_precision'],
+            'recall': metrics['eval_recall'],
+            'f1': metrics['eval_f1']
+        })
+        self.write()
+
+    def write(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.summary, f, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class CheckpointCompleteCallback(TrainerCallback):
+    # Marks a checkpoint as complete once all of its files are on disk. The
+    # Trainer writes checkpoints in place, so a checkpoint without the marker
+    # may have been cut off and is never resumed from.
+    def on_save(self, args, state, control, **kwargs):
+        checkpoint_dir = os.path.join(args.output_dir, f"checkpoint-{state.global_step}")
+        for name in os.listdir(checkpoint_dir):
+            with open(os.path.join(checkpoint_dir, name), 'rb') as f:
+                os.fsync(f.fileno())
+        marker_path = os.path.join(checkpoint_dir, COMPLETE_MARKER)
+        with open(marker_path + '.tmp', 'w') as f:
+            json.dump({'epoch': round(state.epoch), 'step': state.global_step}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(marker_path + '.tmp', marker_path)
+
+
+class ProgressEventsCallback(TrainerCallback):
+    # Reports training steps and the logged loss as --progress-fd events
+    def __init__(self, events, train_size):
+        self.events = events
+        self.train_size = train_size
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        samples_per_step = self.train_size * args.num_train_epochs / max(state.max_steps, 1)
+        self.events.start('train', state.max_steps, state.global_step, samples_per_step)
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self.events.emit(state.global_step, state.max_steps)
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs and 'loss' in logs:
+            self.events.emit(state.global_step, state.max_steps, loss=logs['loss'])
+
+
+def latest_checkpoint(run_dir):
+    # The complete checkpoint with the most training steps in run_dir, or None
+    if not os.path.isdir(run_dir):
+        return None
+    checkpoints = [name for name in os.listdir(run_dir)
+                   if name.startswith("checkpoint-") and os.path.exists(os.path.join(run_dir, name, COMPLETE_MARKER))]
+    if not checkpoints:
+        return None
+    return os.path.join(run_dir, max(checkpoints, key=lambda name: int(name.split('-')[1])))
+
+
+def cpu_supports_bf16():
+    # bf16 only speeds up training on CPUs with native bf16 instructions
+    # (AVX512-BF16 or AMX on x86, the BF16 extension on ARM)
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            cpuinfo = f.read()
+    except OSError:
+        return False
+    return re.search(r'\b(avx512_bf16|amx_bf16|bf16)\b', cpuinfo) is not None
+
+
+def apply_fast_cpu_profile():
+    # Thread settings for CPU-only training; returns whether bf16 autocast is used
+    cores = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    interop_threads = 2 if cores >= 8 else 1
+    torch.set_num_threads(cores)
+    torch.set_num_interop_threads(interop_threads)
+    bf16 = cpu_supports_bf16()
+    print(f"fast-cpu profile: {cores} intra-op and {interop_threads} inter-op threads, "
+          f"bf16 autocast {'on' if bf16 else 'off (no bf16 support in this CPU)'}, "
+          f"{FAST_CPU_ACCUMULATION} gradient accumulation steps per batch")
+    return bf16
+
+
+def stratified_split(labels, fraction, seed=42):
+    # Hold out the same fraction of every label, keeping at least one example
+    # of each label for training
+    by_label = {}
+    for index, label in enumerate(labels):
+        by_label.setdefault(label, []).append(index)
+    generator = random.Random(seed)
+    train_indices = []
+    eval_indices = []
+    for label in sorted(by_label):
+        indices = by_label[label]
+        generator.shuffle(indices)
+        count = min(len(indices) - 1, round(len(indices) * fraction))
+        eval_indices += indices[:count]
+        train_indices += indices[count:]
+    return sorted(train_indices), sorted(eval_indices)
+
+
+def stratified_folds(labels, folds, seed=42):
+    # Split the example indices into folds with the same label mix. The
+    # examples of every label are dealt out in turn, continuing where the
+    # previous label stopped, so the fold sizes differ by at most one.
+    by_label = {}
+    for index, label in enumerate(labels):
+        by_label.setdefault(label, []).append(index)
+    generator = random.Random(seed)
+    fold_indices = [[] for _ in range(folds)]
+    position = 0
+    for label in sorted(by_label):
+        indices = by_label[label]
+        generator.shuffle(indices)
+        for index in indices:
+            fold_indices[position % folds].append(index)
+            position += 1
+    return [sorted(indices) for indices in fold_indices]
+
+
+def example_hash(text, label):
+    return hashlib.sha256(f"{label}\0{text}".encode('utf-8')).hexdigest()
+
+
+def load_seen_examples(model_dir):
+    # Hashes of the (text, label) pairs the model in model_dir was trained on
+    path = os.path.join(model_dir, 'train_examples.json')
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        return set(json.load(f))
+
+
+def grow_classifier(model, num_labels):
+    # Add output rows for new labels; the rows of the existing labels keep their weights
+    old = model.classifier
+    new = torch.nn.Linear(old.in_features, num_labels)
+    model._init_weights(new)
+    with torch.no_grad():
+        new.weight[:old.out_features] = old.weight
+        new.bias[:old.out_features] = old.bias
+    model.classifier = new
+    model.num_labels = num_labels
+    model.config.num_labels = num_labels
+
+
+def tokenize_training_set(tokenizer, texts, labels, id2label):
+    # Token ids are stored unpadded with their length; batches are padded by the
+    # data collator to their own longest paragraph only. Returns (dataset, reused),
+    # reusing the tokenized dataset of an earlier run when the texts, labels and
+    # tokenizer are unchanged.
+    def preprocess_function(examples):
+        tokens = tokenizer(examples["text"], truncation=True)
+        tokens['length'] = [len(ids) for ids in tokens['input_ids']]
+        return tokens
+
+    return load_tokenized_dataset(texts, labels, id2label, tokenizer, preprocess_function,
+                                  {'truncation': True, 'padding': False, 'length': True, 'map_batch_size': 1000})
+
+
+def compute_metrics(prediction):
+    predicted = prediction.predictions.argmax(-1)
+    precision, recall, f1, _ = precision_recall_fscore_support(prediction.label_ids, predicted, average='weighted', zero_division=0)
+    return {
+        'accuracy': float((predicted == prediction.label_ids).mean()),
+        'precision': float(precision),
+        'recall': float(recall),
+        'f1': float(f1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DistilBERT Training Script")
+    parser.add_argument('--max-tokens', type=int, help="Build batches of up to this many padded tokens instead of 8 paragraphs each")
+    parser.add_argument('--eval-split', type=float, metavar='FRACTION', help="Hold out this fraction of every label for evaluation after each epoch and stop early")
+    parser.add_argument('--patience', type=int, default=3, help="With --eval-split, epochs without a better hold-out F1 score before training stops (default: 3)")
+    parser.add_argument('--incremental', action='store_true', help="Continue training trained_model_1 on examples it was not trained on, mixed with a replay sample of older examples")
+    parser.add_argument('--replay-ratio', type=float, default=1.0, help="With --incremental, older examples replayed per new example (default: 1.0)")
+    parser.add_argument('--profile', choices=('default', 'fast-cpu'), default='default',
+                        help="fast-cpu: bf16 autocast where the CPU supports it, threads set from the core count and smaller micro-batches with gradient accumulation (default: default)")
+    parser.add_argument('--compile', action='store_true', help="With --profile fast-cpu, also run the model through torch.compile")
+    parser.add_argument('--resume', action='store_true', help=f"Continue an interrupted run from its latest checkpoint in {RUN_DIR} with the settings it was started with")
+    parser.add_argument('--progress-fd', type=int, metavar='FD', help="Write JSON-lines progress events (phase, step, total, samples/s, loss, ETA) to this open file descriptor")
+    args = parser.parse_args()
+
+    # A resumed run keeps the settings it was started with
+    resume_checkpoint = None
+    if args.resume:
+        resume_checkpoint = latest_checkpoint(RUN_DIR)
+        if resume_checkpoint is None:
+            parser.error(f"No interrupted training run with a complete checkpoint in {RUN_DIR}.")
+        with open(os.path.join(RUN_DIR, 'run.json'), 'r') as f:
+            run_info = json.load(f)
+        args = argparse.Namespace(**{**run_info['args'], 'resume': True, 'progress_fd': args.progress_fd})
+        print(f"Resuming from {resume_checkpoint} with the settings of the interrupted run")
+    if args.max_tokens is not None and args.max_tokens < 1:
+        parser.error("--max-tokens must be at least 1")
+    if args.eval_split is not None and not 0 < args.eval_split < 1:
+        parser.error("--eval-split must be between 0 and 1")
+    if args.patience < 1:
+        parser.error("--patience must be at least 1")
+    if args.replay_ratio < 0:
+        parser.error("--replay-ratio must not be negative")
+    if args.compile and args.profile != 'fast-cpu':
+        parser.error("--compile requires --profile fast-cpu")
+
+    # Threads have to be set before torch runs anything in parallel
+    bf16 = apply_fast_cpu_profile() if args.profile == 'fast-cpu' else False
+    events = ProgressEvents(args.progress_fd)
+
+    output_dir = "trained_model_1"
+    if args.incremental and not os.path.isdir(output_dir):
+        parser.error(f"--incremental needs an existing {output_dir}. Train it without --incremental first.")
+
+    with open('train_labels.json', 'r') as f:
+        data = json.load(f)
+
+    id2label = {int(k): v['label'] for k, v in data.items()}
+    label2id = {v: k for k, v in id2label.items()}
+    num_labels = len(id2label)
+
+    with open('train_input.json', 'r') as file:
+        train_dataset = json.load(file)
+
+    # Convert the list of dictionaries to separate lists for text and labels
+    texts = [item['text'] for item in train_dataset]
+    labels = [item['label'] for item in train_dataset]
+
+    # Fingerprint of the training data, so a run is never resumed on changed data
+    data_digest = hashlib.sha256(json.dumps(id2label, sort_keys=True).encode())
+    for text, label in zip(texts, labels):
+        data_digest.update(example_hash(text, label).encode())
+    data_fingerprint = data_digest.hexdigest()
+    if args.resume and run_info['data'] != data_fingerprint:
+        print("train_input.json or train_labels.json changed since the interrupted run started. Start a new run without --resume.")
+        exit(1)
+
+    tokenizer = AutoTokenizer.from_pretrained("distilbert/distilbert-base-uncased", clean_up_tokenization_spaces=True)
+
+    events.start('tokenize')
+    tokenized_dataset, reused = tokenize_training_set(tokenizer, texts, labels, id2label)
+    print("Reusing the cached tokenized dataset" if reused else "Tokenized the training dataset")
+
+    # Metrics of an earlier run must not be shown for this one; a resumed run
+    # keeps the metrics of the epochs finished before the interruption
+    metrics_path = 'train_metrics.json'
+    previous_epochs = []
+    if os.path.exists(metrics_path):
+        if args.resume:
+            with open(metrics_path, 'r') as f:
+                resumed_step = int(resume_checkpoint.rsplit('-', 1)[1])
+                previous_epochs = [epoch for epoch in json.load(f)['epochs'] if epoch['step'] <= resumed_step]
+        else:
+            os.remove(metrics_path)
+
+    train_indices = list(range(len(texts)))
+    eval_dataset = None
+    if args.eval_split is not None:
+        train_indices, eval_indices = stratified_split(labels, args.eval_split)
+        if not eval_indices:
+            parser.error("--eval-split leaves no examples for evaluation; use a larger fraction or more examples")
+        eval_dataset = tokenized_dataset.select(eval_indices)
+        print(f"Training on {len(train_indices)} examples, evaluating on {len(eval_indices)} held-out examples")
+
+    # With --incremental, train on the examples the current model has not seen
+    # (new texts or changed labels) plus a random sample of the older ones, so
+    # the model does not forget what it learned before
+    seen_examples = load_seen_examples(output_dir) if args.incremental else set()
+    if args.incremental:
+        new_indices = [index for index in train_indices if example_hash(texts[index], labels[index]) not in seen_examples]
+        old_indices = [index for index in train_indices if example_hash(texts[index], labels[index]) in seen_examples]
+        if not new_indices:
+            print(f"{output_dir} has already been trained on every example in train_input.json.")
+            return
+        replay_indices = random.Random(42).sample(old_indices, min(len(old_indices), round(len(new_indices) * args.replay_ratio)))
+        train_indices = sorted(new_indices + replay_indices)
+        print(f"Incremental training on {len(new_indices)} new and {len(replay_indices)} replayed examples")
+    trained_examples = seen_examples | {example_hash(texts[index], labels[index]) for index in train_indices}
+    if len(train_indices) < len(tokenized_dataset):
+        tokenized_dataset = tokenized_dataset.select(train_indices)
+
+    data_collator = DataCollatorWithPadding(tokenizer=tokenizer)
+
+    if args.incremental:
+        model = AutoModelForSequenceClassification.from_pretrained(output_dir)
+        if num_labels < model.config.num_labels:
+            parser.error(f"train_labels.json has fewer labels than {output_dir}. Retrain without --incremental.")
+        # The classifier rows of the current labels are kept, so their ids must
+        # still mean the same labels (nothing renamed, reordered or replaced)
+        changed = [f"{label_id}: {name} -> {id2label.get(label_id)}"
+                   for label_id, name in sorted(model.config.id2label.items()) if id2label.get(label_id) != name]
+        if changed:
+            parser.error(f"Labels of {output_dir} changed in train_labels.json ({', '.join(changed)}). Retrain without --incremental.")
+        if num_labels > model.config.num_labels:
+            print(f"Adding {num_labels - model.config.num_labels} new labels to the classifier")
+            grow_classifier(model, num_labels)
+        model.config.id2label = id2label
+        model.config.label2id = label2id
+    else:
+        model = AutoModelForSequenceClassification.from_pretrained(
+            "distilbert/distilbert-base-uncased",
+            num_labels=num_labels,
+            id2label=id2label,
+            label2id=label2id,
+            problem_type="single_label_classification"
+        )
+
+    # Checkpoints are written to RUN_DIR; trained_model_1 is only replaced once
+    # training has finished
+    if not args.resume:
+        if os.path.exists(RUN_DIR):
+            shutil.rmtree(RUN_DIR)
+        os.makedirs(RUN_DIR)
+        with open(os.path.join(RUN_DIR, 'run.json'), 'w') as f:
+            json.dump({'args': {name: value for name, value in vars(args).items() if name not in ('resume', 'progress_fd')}, 'data': data_fingerprint}, f, indent=2)
+
+    # Settings that depend on the options are collected first: TrainingArguments
+    # derives dependent settings (e.g. greater_is_better) only when it is built
+    training_options = dict(
+        output_dir=RUN_DIR,
+        save_strategy="epoch",
+        save_total_limit=2,  # The previous checkpoint stays until the next one is complete
+        learning_rate=2e-5,
+        per_device_train_batch_size=8,
+        num_train_epochs=16,
+        weight_decay=0.01,
+        group_by_length=True,  # Batches of 8 paragraphs with similar lengths
+        length_column_name='length'
+    )
+    if eval_dataset is not None:
+        # Evaluate after every epoch and keep the checkpoint with the best F1 score
+        training_options.update(
+            eval_strategy="epoch",
+            load_best_model_at_end=True,
+            metric_for_best_model='f1',
+            greater_is_better=True
+        )
+    max_tokens = args.max_tokens
+    if args.profile == 'fast-cpu':
+        # Smaller micro-batches keep activations in cache; accumulating their
+        # gradients keeps the effective batch size of the default profile
+        training_options.update(
+            per_device_train_batch_size=8 // FAST_CPU_ACCUMULATION,
+            gradient_accumulation_steps=FAST_CPU_ACCUMULATION,
+            bf16=bf16,
+            torch_compile=args.compile
+        )
+        if max_tokens is not None:
+            max_tokens = max(1, max_tokens // FAST_CPU_ACCUMULATION)
+    if args.progress_fd is not None:
+        training_options['logging_steps'] = 0.02  # Log the loss 50 times per run for the progress events
+    training_args = TrainingArguments(**training_options)
+
+    trainer_options = dict(
+        model=model,
+        args=training_args,
+        train_dataset=tokenized_dataset,
+        data_collator=data_collator,
+        tokenizer=tokenizer,
+        callbacks=[CheckpointCompleteCallback(), ProgressEventsCallback(events, len(tokenized_dataset))]
+    )
+    metrics_summary = None
+    if eval_dataset is not None:
+        metrics_summary = {'train_size': len(tokenized_dataset), 'eval_size': len(eval_dataset), 'epochs': previous_epochs}
+        metrics_callback = MetricsFileCallback(metrics_path, metrics_summary)
+        trainer_options.update(
+            eval_dataset=eval_dataset,
+            compute_metrics=compute_metrics
+        )
+        trainer_options['callbacks'] += [EarlyStoppingCallback(early_stopping_patience=args.patience), metrics_callback]
+    if args.max_tokens is None:
+        trainer = Trainer(**trainer_options)
+    else:
+        trainer = TokenBudgetTrainer(**trainer_options, max_tokens=max_tokens)
+
+    train_result = trainer.train(resume_from_checkpoint=resume_checkpoint)
+    print(f"Training throughput: {train_result.metrics['train_samples_per_second']:.1f} samples/s "
+          f"({train_result.metrics['train_runtime']:.1f}s, {args.profile} profile)")
+
+    events.start('save')
+
+    # The last checkpoint (the best one with --eval-split) becomes the model.
+    # It replaces trained_model_1 with two renames, so there is always either
+    # the previous or the new model on disk.
+    last_checkpoint_dir = trainer.state.best_model_checkpoint or latest_checkpoint(RUN_DIR)
+    os.remove(os.path.join(last_checkpoint_dir, COMPLETE_MARKER))
+
+    # Remember what the model was trained on for later --incremental runs
+    with open(os.path.join(last_checkpoint_dir, 'train_examples.json'), 'w') as f:
+        json.dump(sorted(trained_examples), f)
+
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir + '.old', ignore_errors=True)
+        os.rename(output_dir, output_dir + '.old')
+    os.rename(last_checkpoint_dir, output_dir)
+    shutil.rmtree(output_dir + '.old', ignore_errors=True)
+    shutil.rmtree(RUN_DIR)
+
+    if metrics_summary is not None:
+        best_step = int(last_checkpoint_dir.rsplit('-', 1)[1])
+        best = next(epoch for epoch in metrics_summary['epochs'] if epoch['step'] == best_step)
+        metrics_summary.update(
+            best_epoch=best['epoch'],
+            best_f1=best['f1'],
+            epochs_run=round(trainer.state.epoch),
+            stopped_early=trainer.state.epoch < training_args.num_train_epochs
+        )
+        metrics_callback.write()
+        print(f"Best hold-out F1 {best['f1']:.4f} after epoch {best['epoch']} of {metrics_summary['epochs_run']}"
+              + (" (stopped early)" if metrics_summary['stopped_early'] else ""))
+    events.start('done')
+    events.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,116 +1,173 @@
 # this script will validate the output of the distilbert_infer.py script
 # it will compare the assigned labels in output in infer_output.json to the train_input.json file and print the results
+# if infer_output.npz (distilbert_infer.py --compact) is newer than infer_output.json it will be read instead
 # it will print the precision, recall, and f1 score for top label (if "results" list has more than one label or just "label" is present instead of "results" list)
 # it will also print the overall precision, recall, and f1 score
+# training texts are looked up in a hash index (ignoring whitespace differences) and the inferred results are read in a single pass
+# --exact only matches identical texts, as earlier versions of this script did
 
+import argparse
 import json
+import os
 from collections import Counter
-from sklearn.metrics import precision_recall_fscore_support
-import warnings
-
-def get_top_label(item):
-    if 'results' in item:
-        return item['results'][0]['label']
-    return item['label']
-
-with open('train_input.json', 'r') as file:
-    train_dataset = json.load(file)
-
-with open('infer_output.json', 'r') as file:
-    infer_dataset = json.load(file)
-
-with open('train_labels.json', 'r') as file:
-    label_mapping = {str(k): v['label'] for k, v in json.load(file).items()}
-
-# Create a dictionary to map text to labels from train_dataset
-train_text_to_label = {item['text']: label_mapping[str(item['label'])] for item in train_dataset}
-
-# Count how many infer_dataset texts are in train_dataset
-matching_texts = sum(1 for item in infer_dataset if any(train_item['text'] == item['text'] for train_item in train_dataset))
-total_infer_texts = len(infer_dataset)
-total_train_texts = len(train_dataset)
-
-print("Proceeding with validation.")
-
-true_labels = []
-predicted_labels = []
-mistakes = []
-
-for infer_item in infer_dataset:
-    text = infer_item['text']
-    if text in train_text_to_label:
-        true_label = train_text_to_label[text]
-        predicted_label = get_top_label(infer_item)
-        true_labels.append(true_label)
-        predicted_labels.append(predicted_label)
-        
-        if true_label != predicted_label:
-            text_preview = text[:100] + ('...' if len(text) > 100 else '')
-            mistakes.append((text_preview, predicted_label, true_label))
-
-print("\nMistakes:")
-for text, pred_label, true_label in mistakes:
-    print(f"Text: {text}")
-    print(f"Predicted: {pred_label}")
-    print(f"Correct: {true_label}")
-    print()
-
-# calculate metrics
-with warnings.catch_warnings():
-    warnings.simplefilter("ignore")
-    precision, recall, f1, _ = precision_recall_fscore_support(true_labels, predicted_labels, average='weighted', zero_division=0)
-
-# print the results
-print("Top Label Metrics:")
-print(f"Precision: {precision:.4f}")
-print(f"Recall: {recall:.4f}")
-print(f"F1 Score: {f1:.4f}")
-
-# calculate overall metrics
-all_true_labels = []
-all_predicted_labels = []
-
-for infer_item in infer_dataset:
-    text = infer_item['text']
-    if text in train_text_to_label:
-        true_label = train_text_to_label[text]
-        if 'results' in infer_item:
-            predicted_labels = [result['label'] for result in infer_item['results']]
+from compact_output import read_compact
+
+
+def normalize_text(text):
+    # Paragraphs match regardless of surrounding, repeated or different whitespace
+    return ' '.join(text.split())
+
+
+class ConfusionMatrix:
+    # Counts of (true label, predicted label) pairs, added one prediction at a
+    # time. The weighted scores match sklearn's precision_recall_fscore_support
+    # with average='weighted' and zero_division=0.
+    def __init__(self):
+        self.counts = Counter()
+
+    def add(self, true_label, predicted_label):
+        self.counts[(true_label, predicted_label)] += 1
+
+    def per_label(self):
+        # label -> (precision, recall, f1, support)
+        true_positives = Counter()
+        true_totals = Counter()
+        predicted_totals = Counter()
+        for (true_label, predicted_label), count in self.counts.items():
+            true_totals[true_label] += count
+            predicted_totals[predicted_label] += count
+            if true_label == predicted_label:
+                true_positives[true_label] += count
+        scores = {}
+        for label in set(true_totals) | set(predicted_totals):
+            precision = true_positives[label] / predicted_totals[label] if predicted_totals[label] else 0.0
+            recall = true_positives[label] / true_totals[label] if true_totals[label] else 0.0
+            f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            scores[label] = (precision, recall, f1, true_totals[label])
+        return scores
+
+    def weighted(self):
+        # (precision, recall, f1) averaged over the labels, weighted by their support
+        scores = self.per_label().values()
+        support = sum(label_support for _, _, _, label_support in scores)
+        if not support:
+            return 0.0, 0.0, 0.0
+        return tuple(sum(label_scores[metric] * label_scores[3] for label_scores in scores) / support for metric in range(3))
+
+
+def build_train_index(train_dataset, label_mapping, exact=False):
+    # Normalized (or with exact, unchanged) text -> label name; a repeated text keeps its last label
+    key = (lambda text: text) if exact else normalize_text
+    return {key(item['text']): label_mapping[str(item['label'])] for item in train_dataset}
+
+
+def read_predictions():
+    # Yield (text, predicted labels best first) for every inferred paragraph
+    output_files = [path for path in ('infer_output.json', 'infer_output.npz') if os.path.exists(path)]
+    if output_files and max(output_files, key=os.path.getmtime) == 'infer_output.npz':
+        labels, label_ids, _, texts, top_label = read_compact('infer_output.npz')
+        for text, ids in zip(texts, label_ids.tolist()):
+            yield text, [labels[ids[0]]] if top_label else [labels[index] for index in ids]
+        return
+    with open('infer_output.json', 'r') as file:
+        infer_dataset = json.load(file)
+    for item in infer_dataset:
+        if 'results' in item:
+            yield item['text'], [result['label'] for result in item['results']]
         else:
-            predicted_labels = [infer_item['label']]
-        
-        all_true_labels.extend([true_label] * len(predicted_labels))
-        all_predicted_labels.extend(predicted_labels)
-
-with warnings.catch_warnings():
-    warnings.simplefilter("ignore")
-    overall_precision, overall_recall, overall_f1, _ = precision_recall_fscore_support(all_true_labels, all_predicted_labels, average='weighted', zero_division=0)
-
-print("\nOverall Metrics:")
-print(f"Precision: {overall_precision:.4f}")
-print(f"Recall: {overall_recall:.4f}")
-print(f"F1 Score: {overall_f1:.4f}")
-
-# Calculate the percentage of mistakes compared to the amount of text in train dataset
-total_mistakes = len(mistakes)
-
-mistake_percentage = (total_mistakes / matching_texts) * 100
-correct_percentage = 100 - mistake_percentage
-
-print("\nPrediction Accuracy:")
-print(f"Correct: {correct_percentage:.2f}%")
-print(f"Incorrect: {mistake_percentage:.2f}%")
-print(f"Total mistakes: {total_mistakes}")
-print(f"Total matching texts: {matching_texts}")
-print(f"Total texts in train dataset: {total_train_texts}")
-print(f"Total texts in infer dataset: {total_infer_texts}")
-
-# Count occurrences of each label
-label_counter = Counter(get_top_label(item) for item in infer_dataset)
-
-# Calculate and display label percentages
-total_labels = sum(label_counter.values())
-print("\nLabel Percentages:")
-for label, count in label_counter.most_common():
-    percentage = (count / total_labels) * 100
-    print(f"{label}: {percentage:.2f}%")
+            yield item['text'], [item['label']]
+
+
+def validate(train_index, predictions, exact=False):
+    # One pass over (text, predicted labels) pairs. The top label goes into
+    # the top label matrix, every listed label into the overall matrix.
+    # exact must be the same as for build_train_index.
+    key = (lambda text: text) if exact else normalize_text
+    report = {
+        'top': ConfusionMatrix(),
+        'overall': ConfusionMatrix(),
+        'mistakes': [],
+        'matching_texts': 0,
+        'total_infer_texts': 0,
+        'label_counter': Counter()
+    }
+    for text, predicted_labels in predictions:
+        report['total_infer_texts'] += 1
+        report['label_counter'][predicted_labels[0]] += 1
+        true_label = train_index.get(key(text))
+        if true_label is None:
+            continue
+        report['matching_texts'] += 1
+        report['top'].add(true_label, predicted_labels[0])
+        for predicted_label in predicted_labels:
+            report['overall'].add(true_label, predicted_label)
+        if true_label != predicted_labels[0]:
+            text_preview = text[:100] + ('...' if len(text) > 100 else '')
+            report['mistakes'].append((text_preview, predicted_labels[0], true_label))
+    return report
+
+
+def print_report(report, total_train_texts):
+    print("\nMistakes:")
+    for text, pred_label, true_label in report['mistakes']:
+        print(f"Text: {text}")
+        print(f"Predicted: {pred_label}")
+        print(f"Correct: {true_label}")
+        print()
+
+    precision, recall, f1 = report['top'].weighted()
+    print("Top Label Metrics:")
+    print(f"Precision: {precision:.4f}")
+    print(f"Recall: {recall:.4f}")
+    print(f"F1 Score: {f1:.4f}")
+
+    overall_precision, overall_recall, overall_f1 = report['overall'].weighted()
+    print("\nOverall Metrics:")
+    print(f"Precision: {overall_precision:.4f}")
+    print(f"Recall: {overall_recall:.4f}")
+    print(f"F1 Score: {overall_f1:.4f}")
+
+    # Calculate the percentage of mistakes compared to the amount of text in train dataset
+    total_mistakes = len(report['mistakes'])
+    matching_texts = report['matching_texts']
+    mistake_percentage = (total_mistakes / matching_texts) * 100 if matching_texts else 0.0
+    correct_percentage = 100 - mistake_percentage if matching_texts else 0.0
+
+    print("\nPrediction Accuracy:")
+    print(f"Correct: {correct_percentage:.2f}%")
+    print(f"Incorrect: {mistake_percentage:.2f}%")
+    print(f"Total mistakes: {total_mistakes}")
+    print(f"Total matching texts: {matching_texts}")
+    print(f"Total texts in train dataset: {total_train_texts}")
+    print(f"Total texts in infer dataset: {report['total_infer_texts']}")
+
+    # Calculate and display label percentages
+    total_labels = sum(report['label_counter'].values())
+    print("\nLabel Percentages:")
+    for label, count in report['label_counter'].most_common():
+        percentage = (count / total_labels) * 100
+        print(f"{label}: {percentage:.2f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DistilBERT Inference Validation Script")
+    parser.add_argument('--exact', action='store_true',
+                        help="Only match paragraphs whose text is identical to a training text, without ignoring whitespace differences (the matching of earlier versions)")
+    args = parser.parse_args()
+
+    with open('train_input.json', 'r') as file:
+        train_dataset = json.load(file)
+
+    with open('train_labels.json', 'r') as file:
+        label_mapping = {str(k): v['label'] for k, v in json.load(file).items()}
+
+    train_index = build_train_index(train_dataset, label_mapping, args.exact)
+
+    print("Proceeding with validation.")
+
+    report = validate(train_index, read_predictions(), args.exact)
+    print_report(report, len(train_dataset))
+
+
+if __name__ == '__main__':
+    main()
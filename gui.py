@@ -7,8 +7,9 @@ import sys
 import venv
 import shutil
 import webbrowser
-import threading
-import time
+import queue
+import daemon_client
+import progress_events
 
 class NoteSort:
     def __init__(self, master):
@@ -16,8 +17,11 @@ class NoteSort:
         self.master.title("NoteSort")
         self.master.geometry("800x600")
 
+        self.daemon_process = None
+
         self.setup_environment()
         self.create_gui()
+        self.master.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def setup_environment(self):
         venv_dir = 'venv'
@@ -148,6 +152,16 @@ class NoteSort:
         training_process_frame = tk.LabelFrame(training_top_frame, text="Process", padx=5, pady=5)
         training_process_frame.pack(fill=tk.X, pady=5)
 
+        # Checkbox for the hold-out split with early stopping
+        self.early_stopping = tk.BooleanVar()
+        tk.Checkbutton(training_process_frame, text="Stop early (hold out 10% for evaluation)",
+                       variable=self.early_stopping, font=small_font).pack(pady=2)
+
+        # Checkbox for incremental training of the current model
+        self.incremental_training = tk.BooleanVar()
+        tk.Checkbutton(training_process_frame, text="Only train on new examples (keep current model)",
+                       variable=self.incremental_training, font=small_font).pack(pady=2)
+
         self.start_training_button = tk.Button(training_process_frame, text="Start Training",
                   command=self.start_training, font=small_font, state=tk.DISABLED)
         self.start_training_button.pack(pady=2)
@@ -184,6 +198,11 @@ class NoteSort:
         tk.Checkbutton(inferring_process_frame, text="Only keep top label in output",
                        variable=self.top_label_only, font=small_font).pack(pady=2)
         
+        # Checkbox for the background inference daemon
+        self.keep_model_loaded = tk.BooleanVar()
+        tk.Checkbutton(inferring_process_frame, text="Keep model loaded in background",
+                       variable=self.keep_model_loaded, command=self.toggle_daemon, font=small_font).pack(pady=2)
+
         self.start_inferring_button = tk.Button(inferring_process_frame, text="Start Inferring",
                   command=self.start_inferring, font=small_font, state=tk.DISABLED)
         self.start_inferring_button.pack(pady=2)
@@ -346,13 +365,25 @@ class NoteSort:
         LabelGenerator(self.master)
 
     def start_training(self):
-        # Backup existing trained_model_1 directory if it exists
-        if os.path.exists("trained_model_1"):
+        # Offer to continue a run that was interrupted (GUI closed, reboot, out of memory)
+        resume = False
+        interrupted_epoch = self.interrupted_training_epoch()
+        if interrupted_epoch is not None:
+            answer = messagebox.askyesnocancel("Resume Training",
+                                               f"An interrupted training run was found (last saved epoch: {interrupted_epoch}).\n\n"
+                                               "Resume it? Choose No to start a new training run.")
+            if answer is None:
+                return
+            resume = answer
+
+        # Backup existing trained_model_1 directory if it exists. distilbert_train.py
+        # only replaces it once training has finished, so it is copied and stays usable.
+        if os.path.exists("trained_model_1") and not resume:
             backup_name = "trained_model_1_backup"
             counter = 1
             while os.path.exists(f"{backup_name}_{counter}"):
                 counter += 1
-            shutil.move("trained_model_1", f"{backup_name}_{counter}")
+            shutil.copytree("trained_model_1", f"{backup_name}_{counter}")
             messagebox.showinfo("Backup Created", f"Existing model backed up as {backup_name}_{counter}")
 
         progress_window = tk.Toplevel(self.master)
@@ -363,48 +394,102 @@ class NoteSort:
         progress_bar.pack(pady=10)
         progress_bar.start()
 
-        def run_training():
-            try:
-                process = subprocess.Popen([os.path.join('venv', 'bin', 'python'), "distilbert_train.py"],
-                                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-                
-                start_time = time.time()
-                real_progress_started = False
-
-                def update_progress():
-                    nonlocal real_progress_started
-                    if process.poll() is None:  # If the process is still running
-                        output = process.stdout.readline().strip()
-                        if output:
-                            if "%" in output and "|" in output and "Map" not in output:
-                                if not real_progress_started:
-                                    real_progress_started = True
-                                    progress_bar.stop()
-                                    progress_bar.config(mode='determinate')
-                                percentage = int(output.split("|")[0].strip().replace("%", ""))
-                                progress_bar['value'] = percentage
-                                elapsed_time = int(time.time() - start_time)
-                                estimated_total_time = int(elapsed_time * 100 / percentage) if percentage > 0 else 0
-                                remaining_time = max(0, estimated_total_time - elapsed_time)
-                                progress_label.config(text=f"Training progress: {percentage}% (ETA: {remaining_time//60}m {remaining_time%60}s)")
-                            elif not real_progress_started:
-                                progress_label.config(text="Training in progress...")
-                        progress_window.after(100, update_progress)
-                    else:
-                        progress_window.destroy()
-                        if process.returncode == 0:
-                            messagebox.showinfo("Training Complete", "Model training has finished successfully.")
-                        else:
-                            messagebox.showerror("Training Error", "An error occurred during training. Check the console for details.")
-
-                update_progress()
-
-            except Exception as e:
-                progress_window.destroy()
-                messagebox.showerror("Error", f"An error occurred: {str(e)}")
+        command = [os.path.join('venv', 'bin', 'python'), "distilbert_train.py"]
+        if resume:
+            command.append("--resume")  # The run keeps the settings it was started with
+        elif self.early_stopping.get():
+            command.extend(["--eval-split", "0.1"])
+        if self.incremental_training.get() and os.path.isdir("trained_model_1") and not resume:
+            command.append("--incremental")
+
+        phase_texts = {'tokenize': "Tokenizing the training set...", 'save': "Saving the model...", 'done': "Finishing..."}
+
+        def show_event(event):
+            if event['phase'] != 'train':
+                progress_label.config(text=phase_texts.get(event['phase'], "Training in progress..."))
+                return
+            if str(progress_bar['mode']) != 'determinate':
+                progress_bar.stop()
+                progress_bar.config(mode='determinate')
+            progress_bar['value'] = event['step'] / max(event['total'], 1) * 100
+            text = f"Training: step {event['step']} of {event['total']} ({event['samples_per_second']:.1f} samples/s)"
+            if event['loss'] is not None:
+                text += f"\nLoss: {event['loss']:.4f}"
+            if event['eta'] is not None:
+                remaining_time = int(event['eta'])
+                text += f"\nETA: {remaining_time // 60}m {remaining_time % 60}s"
+            progress_label.config(text=text)
+
+        def training_finished(returncode):
+            progress_window.destroy()
+            if returncode == 0:
+                messagebox.showinfo("Training Complete", "Model training has finished successfully." + self.training_metrics_summary())
+            else:
+                messagebox.showerror("Training Error", "An error occurred during training. Check the console for details.")
 
-        # Start the training process in a separate thread
-        threading.Thread(target=run_training, daemon=True).start()
+        try:
+            self.follow_progress(progress_window, command, show_event, training_finished)
+        except Exception as e:
+            progress_window.destroy()
+            messagebox.showerror("Error", f"An error occurred: {str(e)}")
+
+    def follow_progress(self, window, command, on_event, on_exit):
+        # Run command with --progress-fd. A reader thread collects its events,
+        # and every 100 ms all pending events are handled here on the Tk thread,
+        # so the progress never falls behind. The console output of the script
+        # is not captured.
+        events = queue.Queue()
+        process = progress_events.launch(command, events)
+
+        finished = False
+
+        def poll():
+            nonlocal finished
+            latest = None
+            while True:
+                try:
+                    event = events.get_nowait()
+                except queue.Empty:
+                    break
+                if event is None:
+                    finished = True
+                else:
+                    latest = event
+            if latest is not None:
+                on_event(latest)
+            if finished and process.poll() is not None:
+                on_exit(process.returncode)
+            else:
+                window.after(100, poll)
+
+        poll()
+
+    def interrupted_training_epoch(self):
+        # Epoch of the latest complete checkpoint of an unfinished distilbert_train.py run
+        epochs = []
+        if os.path.isdir('training_run'):
+            for name in os.listdir('training_run'):
+                marker = os.path.join('training_run', name, 'checkpoint_complete.json')
+                if name.startswith('checkpoint-') and os.path.exists(marker):
+                    with open(marker, 'r') as f:
+                        epochs.append(json.load(f)['epoch'])
+        return max(epochs, default=None)
+
+    def training_metrics_summary(self):
+        # Hold-out results written by distilbert_train.py --eval-split
+        if not os.path.exists('train_metrics.json'):
+            return ""
+        with open('train_metrics.json', 'r') as f:
+            metrics = json.load(f)
+        if 'best_epoch' not in metrics:
+            return ""
+        lines = [f"\n\nBest hold-out F1 score {metrics['best_f1']:.4f} after epoch {metrics['best_epoch']} "
+                 f"({metrics['eval_size']} held-out examples)."]
+        if metrics['stopped_early']:
+            lines.append(f"Stopped early after {metrics['epochs_run']} epochs.")
+        for epoch in metrics['epochs']:
+            lines.append(f"Epoch {epoch['epoch']}: loss {epoch['loss']:.4f}, accuracy {epoch['accuracy']:.4f}, F1 {epoch['f1']:.4f}")
+        return "\n".join(lines)
 
     def choose_input_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("Markdown files", "*.md")])
@@ -439,6 +524,40 @@ class NoteSort:
         save_button = tk.Button(input_window, text="Save", command=save_input)
         save_button.pack(pady=10)
 
+    def toggle_daemon(self):
+        if self.keep_model_loaded.get():
+            # A daemon this window started may still be loading the model
+            starting = self.daemon_process is not None and self.daemon_process.poll() is None
+            if not starting and daemon_client.status() is None:
+                self.daemon_process = subprocess.Popen([os.path.join('venv', 'bin', 'python'), "distilbert_daemon.py"])
+        else:
+            self.stop_daemon()
+
+    def stop_daemon(self):
+        # Only a daemon this window started is stopped; one started from the
+        # command line keeps running. The daemon only listens once its model is
+        # loaded, so it is terminated if the shutdown request does not stop it in
+        # time. The waits are bounded, so the window never hangs.
+        if self.daemon_process is None:
+            return
+        if self.daemon_process.poll() is None:
+            daemon_client.shutdown()
+        try:
+            self.daemon_process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.daemon_process.terminate()
+            try:
+                self.daemon_process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.daemon_process.kill()
+        self.daemon_process = None
+
+    def on_close(self):
+        # Only stop a daemon that this window started
+        if self.daemon_process is not None:
+            self.stop_daemon()
+        self.master.destroy()
+
     def start_inferring(self):
         progress_window = tk.Toplevel(self.master)
         progress_window.title("Inferring Progress")
@@ -447,31 +566,64 @@ class NoteSort:
         progress_bar = ttk.Progressbar(progress_window, length=300, mode='determinate')
         progress_bar.pack(pady=10)
 
+        def run_with_daemon():
+            # The daemon already has the model loaded, so no subprocess is needed
+            with open('infer_input.md', 'r') as f:
+                paragraphs = [paragraph for paragraph in f.read().split('\n\n') if paragraph.strip()]
+
+            def update_progress(done, total):
+                progress_bar['value'] = (done_before + done) / len(paragraphs) * 100
+                progress_window.update()
+
+            results = []
+            for start in range(0, len(paragraphs), 1000):
+                done_before = start
+                chunk_results = daemon_client.classify(paragraphs[start:start + 1000],
+                                                       {'top_label': self.top_label_only.get()},
+                                                       on_progress=update_progress)
+                results.extend(result for result in chunk_results if result is not None)
+
+            with open('infer_output.json', 'w') as outfile:
+                json.dump(results, outfile, indent=2)
+
         def run_inferring():
-            command = [os.path.join('venv', 'bin', 'python'), "distilbert_infer.py", "-s"]
-            if self.top_label_only.get():
-                command.append("-l")
-            
-            process = subprocess.Popen(command, 
-                                       stdout=subprocess.PIPE, 
-                                       stderr=subprocess.STDOUT,
-                                       universal_newlines=True)
-            
-            for line in process.stdout:
+            # Only a daemon serving trained_model_1 with the settings of the
+            # subprocess below gives the same results
+            if daemon_client.matches(daemon_client.status(), "trained_model_1"):
                 try:
-                    if line.startswith("Processing paragraphs:"):
-                        progress = int(line.split("|")[0].split(":")[1].strip().rstrip('%'))
-                        progress_bar['value'] = progress
-                        progress_window.update()
-                except:
-                    # If parsing fails, show an indeterminate progress bar
-                    progress_bar.config(mode='indeterminate')
-                    progress_bar.start()
+                    run_with_daemon()
+                    progress_window.destroy()
+                    messagebox.showinfo("Inferring Complete", "Model inferring has finished.")
+                    return
+                except daemon_client.DaemonUnavailable:
+                    progress_bar['value'] = 0
                     progress_window.update()
 
-            process.wait()
-            progress_window.destroy()
-            messagebox.showinfo("Inferring Complete", "Model inferring has finished.")
+            command = [os.path.join('venv', 'bin', 'python'), "distilbert_infer.py", "--no-daemon"]
+            if self.top_label_only.get():
+                command.append("-l")
+
+            def show_event(event):
+                if event['phase'] == 'load':
+                    progress_label.config(text="Loading the model...")
+                elif event['phase'] == 'infer' and event['total']:
+                    progress_bar['value'] = event['step'] / event['total'] * 100
+                    text = f"Processing paragraphs: {event['step']} of {event['total']} ({event['samples_per_second']:.1f} paragraphs/s)"
+                    if event['eta'] is not None:
+                        remaining_time = int(event['eta'])
+                        text += f"\nETA: {remaining_time // 60}m {remaining_time % 60}s"
+                    progress_label.config(text=text)
+                elif event['phase'] == 'save':
+                    progress_label.config(text="Writing infer_output.json...")
+
+            def inferring_finished(returncode):
+                progress_window.destroy()
+                if returncode == 0:
+                    messagebox.showinfo("Inferring Complete", "Model inferring has finished.")
+                else:
+                    messagebox.showerror("Inferring Error", "An error occurred during inferring. Check the console for details.")
+
+            self.follow_progress(progress_window, command, show_event, inferring_finished)
 
         self.master.after(100, run_inferring)
 
@@ -0,0 +1,73 @@
+import re
+import zlib
+import numpy as np
+
+# MinHash signatures use NUM_PERM hash functions (a * x + b) mod PRIME; the
+# Mersenne prime keeps a * x inside 64 bits for 32-bit shingle hashes
+NUM_PERM = 64
+PRIME = (1 << 31) - 1
+SHINGLE_WORDS = 3
+
+_random = np.random.RandomState(2024)
+_a = _random.randint(1, PRIME, size=NUM_PERM).astype(np.uint64)
+_b = _random.randint(0, PRIME, size=NUM_PERM).astype(np.uint64)
+
+
+def minhash(text):
+    # Signature over the lowercased word trigrams of a paragraph
+    words = re.findall(r'\w+', text.lower())
+    if len(words) >= SHINGLE_WORDS:
+        shingles = {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    else:
+        shingles = {' '.join(words) or text.strip()}
+    hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    return ((np.outer(_a, hashes) + _b[:, None]) % PRIME).min(axis=1)
+
+
+def lsh_rows(threshold):
+    # Rows per LSH band: the most selective banding whose estimated threshold
+    # (1 / bands) ** (1 / rows) stays well below the requested similarity, so
+    # few true matches are missed; candidates are verified afterwards
+    rows = 1
+    for candidate in (2, 4, 8, 16, 32):
+        if (candidate / NUM_PERM) ** (1 / candidate) <= threshold - 0.1:
+            rows = candidate
+    return rows
+
+
+def group_duplicates(texts, near_threshold=None):
+    # Return the index of the representative of every text: the first
+    # occurrence of the same text, or with near_threshold, the first earlier
+    # representative whose estimated Jaccard similarity reaches the threshold
+    representatives = list(range(len(texts)))
+    first_seen = {}
+    for index, text in enumerate(texts):
+        representatives[index] = first_seen.setdefault(text, index)
+    if near_threshold is None:
+        return representatives
+
+    rows = lsh_rows(near_threshold)
+    buckets = {}
+    signatures = {}
+    for index, text in enumerate(texts):
+        if representatives[index] != index:
+            representatives[index] = representatives[representatives[index]]
+            continue
+
+        signature = minhash(text)
+        bands = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(NUM_PERM // rows)]
+        candidates = []
+        for band in bands:
+            for candidate in buckets.get(band, ()):
+                if candidate not in candidates:
+                    candidates.append(candidate)
+        for candidate in sorted(candidates):
+            if np.mean(signatures[candidate] == signature) >= near_threshold:
+                representatives[index] = candidate
+                break
+        else:
+            # Only representatives are indexed, so groups do not drift by chaining
+            signatures[index] = signature
+            for band in bands:
+                buckets.setdefault(band, []).append(index)
+    return representatives
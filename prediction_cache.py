@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+class PredictionCache:
+    # On-disk cache of the raw label probability rows returned by the model, keyed by
+    # paragraph text + trained model files + label mapping. Keyword rules and
+    # normalization are applied after a lookup, so editing them never makes an
+    # entry stale. Least recently used entries are evicted above max_bytes.
+    # variant separates predictions made with different inference settings.
+
+    def __init__(self, path, model_dir, labels_data, max_bytes, variant=''):
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS predictions ("
+                        "key BLOB PRIMARY KEY, scores TEXT NOT NULL, size INTEGER NOT NULL, "
+                        "seconds REAL NOT NULL, last_used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS file_hashes ("
+                        "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL)")
+        self.db.commit()
+
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM predictions").fetchone()[0]
+        self.namespace = (self.model_fingerprint(model_dir) + self.labels_fingerprint(labels_data) + variant).encode()
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    def file_digest(self, path):
+        # Hashing model weights takes a while, so digests are remembered until
+        # the file size or modification time changes
+        stat = os.stat(path)
+        row = self.db.execute("SELECT size, mtime_ns, digest FROM file_hashes WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digest = digest.hexdigest()
+        self.db.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                        (path, stat.st_size, stat.st_mtime_ns, digest))
+        self.db.commit()
+        return digest
+
+    def model_fingerprint(self, model_dir):
+        # Weights, config and tokenizer files; checkpoint subfolders are ignored
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(model_dir)):
+            path = os.path.join(model_dir, name)
+            if os.path.isfile(path):
+                digest.update(name.encode() + b'\0' + self.file_digest(os.path.abspath(path)).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def labels_fingerprint(labels_data):
+        # Only the id -> label mapping changes what the model outputs
+        mapping = {str(k): v['label'] for k, v in labels_data.items()}
+        return hashlib.sha256(json.dumps(mapping, sort_keys=True).encode()).hexdigest()
+
+    def key(self, text):
+        return hashlib.sha256(self.namespace + b'\0' + text.encode()).digest()
+
+    def get_many(self, texts):
+        # Return {index: list of label probabilities} for the texts found in the cache
+        keys = [self.key(text) for text in texts]
+        positions = {}
+        for index, key in enumerate(keys):
+            positions.setdefault(key, []).append(index)
+
+        found = {}
+        unique_keys = list(positions)
+        now = time.time()
+        for start in range(0, len(unique_keys), 500):
+            part = unique_keys[start:start + 500]
+            rows = self.db.execute(
+                f"SELECT key, scores, seconds FROM predictions WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            for key, scores, seconds in rows:
+                for index in positions[key]:
+                    found[index] = json.loads(scores)
+                    self.seconds_saved += seconds
+            self.db.executemany("UPDATE predictions SET last_used = ? WHERE key = ?", [(now, row[0]) for row in rows])
+        self.db.commit()
+
+        self.hits += len(found)
+        self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, entries):
+        # entries: (text, label probabilities, seconds spent on the forward pass)
+        now = time.time()
+        for text, row, seconds in entries:
+            key = self.key(text)
+            scores = json.dumps([float(score) for score in row])
+            size = len(key) + len(scores)
+            previous = self.db.execute("SELECT size FROM predictions WHERE key = ?", (key,)).fetchone()
+            if previous is not None:
+                self.total_bytes -= previous[0]
+            self.db.execute("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)", (key, scores, size, seconds, now))
+            self.total_bytes += size
+        self.evict()
+        self.db.commit()
+
+    def evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        excess = self.total_bytes - self.max_bytes
+        doomed = []
+        for key, size in self.db.execute("SELECT key, size FROM predictions ORDER BY last_used"):
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= size
+            self.total_bytes -= size
+        self.db.executemany("DELETE FROM predictions WHERE key = ?", doomed)
+
+    def summary(self):
+        return (f"Cache: {self.hits} hits, {self.misses} misses, "
+                f"~{self.seconds_saved:.1f}s of model time saved, "
+                f"{self.total_bytes / (1 << 20):.1f} MB stored")
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
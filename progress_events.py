@@ -0,0 +1,114 @@
+# Machine-readable progress of distilbert_train.py and distilbert_infer.py
+# (--progress-fd). Every event is one JSON line, e.g.
+# {"phase": "train", "step": 120, "total": 480, "samples_per_second": 9.6, "loss": 0.41, "eta": 300.2, "time": 1729000000.0}
+# It only uses the standard library, so gui.py can read the events without
+# loading torch or transformers.
+
+import json
+import os
+import subprocess
+import threading
+import time
+
+
+class ProgressEvents:
+    # Writes events to a file descriptor inherited from the parent process.
+    # Without a descriptor every call does nothing, so scripts can report
+    # progress unconditionally.
+    MIN_INTERVAL = 0.25  # Seconds between two events of the same phase, except the first and last step
+
+    def __init__(self, fd=None):
+        self.stream = os.fdopen(fd, 'w', buffering=1) if fd is not None else None
+        self.phase = None
+        self.loss = None
+
+    def start(self, phase, total=None, step=0, samples_per_step=1):
+        # Throughput and ETA are measured from the start of the phase, so a
+        # resumed run does not count the steps it skipped
+        self.phase = phase
+        self.started = time.perf_counter()
+        self.start_step = step
+        self.samples_per_step = samples_per_step
+        self.last_sent = 0.0
+        self.loss = None
+        self.emit(step, total, force=True)
+
+    def emit(self, step, total=None, loss=None, force=False):
+        if self.stream is None:
+            return
+        if loss is not None:
+            self.loss = loss
+            force = True
+        now = time.perf_counter()
+        if not force and step != total and now - self.last_sent < self.MIN_INTERVAL:
+            return
+        self.last_sent = now
+        elapsed = now - self.started
+        steps_per_second = (step - self.start_step) / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if total is not None and steps_per_second > 0:
+            eta = round((total - step) / steps_per_second, 1)
+        self.write({
+            'phase': self.phase,
+            'step': step,
+            'total': total,
+            'samples_per_second': round(steps_per_second * self.samples_per_step, 2),
+            'loss': self.loss,
+            'eta': eta,
+            'time': time.time()
+        })
+
+    def track(self, progress, phase):
+        # Report every update of a tqdm progress bar as well
+        self.start(phase, progress.total, progress.n)
+        update = progress.update
+
+        def update_and_emit(n=1):
+            displayed = update(n)
+            if n:
+                self.emit(progress.n, progress.total)
+            return displayed
+
+        progress.update = update_and_emit
+        return progress
+
+    def write(self, event):
+        try:
+            self.stream.write(json.dumps(event) + '\n')
+        except OSError:
+            self.stream = None  # The reader went away; keep running without events
+
+    def close(self):
+        if self.stream is not None:
+            try:
+                self.stream.close()
+            except OSError:
+                pass
+            self.stream = None
+
+
+def read_events(fd, events):
+    # Put every event from fd on the events queue, then None once the writer
+    # has closed its end (normally when the process exits)
+    with os.fdopen(fd, 'r') as stream:
+        for line in stream:
+            try:
+                events.put(json.loads(line))
+            except ValueError:
+                continue
+    events.put(None)
+
+
+def launch(command, events, **popen_options):
+    # Start command with --progress-fd and read its events in a background
+    # thread, so the caller only has to drain the queue
+    read_fd, write_fd = os.pipe()
+    try:
+        process = subprocess.Popen(command + ['--progress-fd', str(write_fd)], pass_fds=(write_fd,), **popen_options)
+    except Exception:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+    threading.Thread(target=read_events, args=(read_fd, events), daemon=True).start()
+    return process
@@ -0,0 +1,45 @@
+# run with: python3 -m unittest discover tests
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from distilbert_infer import LabelRules, build_results, member_result  # noqa: E402
+
+LABELS_DATA = {
+    '0': {'label': 'sea', 'must_have': ['ocean'], 'increase_if': [], 'decrease_if': []},
+    '1': {'label': 'land', 'must_have': [], 'increase_if': [], 'decrease_if': []}
+}
+
+
+class NearDuplicateResultTest(unittest.TestCase):
+    def setUp(self):
+        self.rules = LabelRules(LABELS_DATA)
+        self.labels = ['sea', 'land']
+        self.row = np.array([0.7, 0.3], dtype=np.float32)
+        self.representative = "The waves roll onto the ocean shore every morning."
+        self.result = build_results(self.rules, self.labels, [self.representative], [self.row], False, False)[0]
+
+    def test_member_gets_its_own_keyword_rules(self):
+        # Only the representative contains the must_have keyword of 'sea'
+        member = "The waves roll onto the shore every morning."
+        result = member_result(self.rules, self.labels, self.row, self.result, member, False, False)
+        self.assertEqual(self.result['results'][0]['label'], 'sea')
+        self.assertEqual(result['text'], member)
+        self.assertEqual(result['results'][0]['label'], 'land')
+        self.assertEqual([entry['score'] for entry in result['results']], [100.0, 0.0])
+
+    def test_member_top_label(self):
+        member = "The waves roll onto the shore every morning."
+        result = member_result(self.rules, self.labels, self.row, self.result, member, False, True)
+        self.assertEqual(result, {'text': member, 'label': 'land'})
+
+    def test_exact_copy_reuses_result(self):
+        result = member_result(self.rules, self.labels, self.row, self.result, self.representative, False, False)
+        self.assertIs(result, self.result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from datasets import Dataset
+
+# Tokenized training sets are saved as Arrow datasets in CACHE_DIR, one folder
+# per key. The key covers the texts and labels, the id -> label mapping, the
+# tokenizer (name, class and its full vocabulary/configuration) and the
+# preprocessing settings, so any change to those tokenizes again.
+CACHE_DIR = 'tokenized_cache'
+KEEP_ENTRIES = 4
+STALE_TEMPORARY_SECONDS = 24 * 3600  # Temporary folders left behind by killed runs
+
+
+def tokenizer_fingerprint(tokenizer):
+    digest = hashlib.sha256()
+    digest.update(f"{tokenizer.name_or_path}\0{type(tokenizer).__name__}\0".encode())
+    if getattr(tokenizer, 'is_fast', False):
+        digest.update(tokenizer.backend_tokenizer.to_str().encode())
+    else:
+        digest.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode())
+    digest.update(json.dumps(tokenizer.init_kwargs, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def dataset_key(texts, labels, id2label, tokenizer, settings):
+    digest = hashlib.sha256()
+    for text, label in zip(texts, labels):
+        digest.update(f"{len(text)}:{label}:".encode() + text.encode('utf-8'))
+    digest.update(json.dumps({str(k): v for k, v in id2label.items()}, sort_keys=True).encode())
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    digest.update(tokenizer_fingerprint(tokenizer).encode())
+    return digest.hexdigest()[:32]
+
+
+def load_tokenized_dataset(texts, labels, id2label, tokenizer, preprocess_function, settings, cache_dir=CACHE_DIR):
+    # Return (dataset, True) when a cached copy was reused, otherwise tokenize
+    # with preprocess_function, save the result and return (dataset, False).
+    # settings must describe everything preprocess_function does.
+    path = os.path.join(cache_dir, dataset_key(texts, labels, id2label, tokenizer, settings))
+    if os.path.isdir(path):
+        try:
+            dataset = Dataset.load_from_disk(path)
+            os.utime(path)
+            return dataset, True
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)  # Partly written or from an incompatible datasets release
+
+    dataset = Dataset.from_dict({'text': texts, 'label': labels}).map(preprocess_function, batched=True)
+
+    # Save into a folder of this process next to the final one and rename, so
+    # an interrupted run never leaves a half-written entry behind and runs that
+    # tokenize the same data at the same time do not touch each other's files
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_path = tempfile.mkdtemp(dir=cache_dir, suffix='.tmp')
+    try:
+        dataset.save_to_disk(temporary_path)
+        os.replace(temporary_path, path)
+    except OSError:
+        # Another run saved the same entry first; use its copy
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+    prune(cache_dir, path)
+    return Dataset.load_from_disk(path), False
+
+
+def prune(cache_dir, in_use, keep=KEEP_ENTRIES):
+    # Keep the most recently used entries only, and never in_use, the entry
+    # that is about to be returned
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        try:
+            modified = os.path.getmtime(entry)
+        except OSError:
+            continue  # Removed by another run
+        if name.endswith('.tmp'):
+            if time.time() - modified > STALE_TEMPORARY_SECONDS:
+                shutil.rmtree(entry, ignore_errors=True)
+        elif entry != in_use:
+            entries.append((modified, entry))
+    entries.sort(reverse=True)
+    for _, entry in entries[keep - 1:]:
+        shutil.rmtree(entry, ignore_errors=True)